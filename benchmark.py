@@ -0,0 +1,1125 @@
+"""
+Benchmarks for the slow parts of the pipeline.
+
+Usage: python benchmark.py parse --profiles 2000 --contracts 2000 [--workers 2]
+       python benchmark.py payments --contracts 2000 --months 30
+       python benchmark.py plans [--db database/origin.db]
+       python benchmark.py overdue --rows 1000000
+       python benchmark.py enrich --rows 1000000
+       python benchmark.py rollrates --rows 1000000
+       python benchmark.py stream --rows 1000000 [--chunk-size 100000]
+       python benchmark.py scorecard --rows 1000000
+       python benchmark.py applicant --requests 100000 --http-requests 5000
+       python benchmark.py memory --profiles 1000000 --payments 1000000
+       python benchmark.py startup
+
+Generated workbooks need the xlwt package (pip install xlwt).
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xlrd
+
+import settings
+from scorecard import SCORECARD, SCORE_COLUMNS, SCORE_WEIGHTS, score_applicant, score_points, total_scores
+from scoring_server import ScoringHandler, ScoringServer
+from general import (CONTRACT_LABELS, PROFILE_LABELS, DBhandler, check_date, create_contract, create_payments,
+                     create_profile, parse_contract, parse_profile)
+from connections import get_connection
+from loans import (BUCKETS, add_contract_columns, compute_performance, default_dates, default_matrix, first_payments,
+                   horizon_payments, load_default_dates, load_first_payments, overdue_days, performance_blocks,
+                   performance_roll_rates, refresh_performance, roll_rates, store_performance, stream_performance)
+from task3 import prepare_profiles
+from woe import load_applications
+
+# Hot queries and the part of their EXPLAIN QUERY PLAN output that proves an index is used
+HOT_QUERIES = [
+    ("SELECT * FROM profile WHERE id = ?", [100000], ["SEARCH profile USING INTEGER PRIMARY KEY"]),
+    ("SELECT * FROM contract WHERE contract_id = ?", [200000], ["SEARCH contract USING INTEGER PRIMARY KEY"]),
+    ("SELECT * FROM contract WHERE id = ?", [100000], ["SEARCH contract USING INDEX contract_id_idx"]),
+    ("SELECT * FROM payment WHERE contract_id = ? ORDER BY payment_date", [200000],
+     ["SEARCH payment USING INDEX payment_contract_date_idx"]),
+    ("SELECT * FROM payment ORDER BY contract_id, payment_date", [], ["SCAN payment USING INDEX payment_contract_date_idx"]),
+    ("SELECT key FROM values_map WHERE column_name = ? AND value = ?", ["position", 1],
+     ["SEARCH values_map USING INDEX values_map_column_value_idx"]),
+    ("SELECT * FROM profile JOIN contract ON profile.id = contract.id", [],
+     ["SEARCH profile USING INTEGER PRIMARY KEY"]),
+    ("SELECT * FROM contract JOIN payment ON contract.contract_id = payment.contract_id", [],
+     ["SEARCH contract USING INTEGER PRIMARY KEY"]),
+    ("SELECT p.*, c.contract_date, c.id, p.rowid FROM payment p LEFT JOIN contract c "
+     "ON c.contract_id = p.contract_id ORDER BY p.contract_id, p.payment_date, p.rowid", [],
+     ["SCAN p USING INDEX payment_contract_date_idx", "SEARCH c USING INTEGER PRIMARY KEY"]),
+]
+
+# Module, the heavy modules it must not import and its import time budget in seconds
+STARTUP_MODULES = [
+    ("main", ["numpy", "pandas", "matplotlib", "sklearn", "xlrd"], 0.2),
+    ("task1", ["pandas", "matplotlib", "sklearn"], 1.0),
+    ("runner", ["pandas", "matplotlib", "sklearn"], 1.0),
+    ("task2", [], None),
+    ("task3", [], None),
+    ("task4", [], None),
+]
+
+
+def legacy_parse_profile(file):
+    # The original create_profile loop, kept as a reference for the benchmark
+    data = xlrd.open_workbook(file)
+    sheet = data.sheet_by_index(0)
+
+    labels = PROFILE_LABELS
+    values = [None for _ in range(len(labels))]
+    row = sheet.nrows
+    column = sheet.ncols
+    for i in range(row):
+        for j in range(column):
+            for k in range(len(labels)):
+                if sheet.cell(i, j).value == labels[k]:
+                    if labels[k] in ("Date of Birth", "Issue Date"):
+                        if check_date(sheet.cell(i + 1, j).value):
+                            values[k] = sheet.cell(i + 1, j).value
+                        else:
+                            temp = datetime.fromordinal(int(sheet.cell(i + 1, j).value))
+                            temp = datetime(day=temp.day, month=temp.month, year=temp.year + 1900)
+                            temp = temp.strftime("%m.%d.%Y")
+                            values[k] = temp
+                    elif labels[k] == 'House ownership':
+                        if sheet.cell(i + 1, j).value == 'Y':
+                            values[k] = 1
+                        elif sheet.cell(i + 1, j).value == 'N':
+                            values[k] = 0
+                        else:
+                            values[k] = None
+                    else:
+                        try:
+                            values[k] = sheet.cell(i + 1, j).value
+                        except IndexError:
+                            values[k] = None
+    return values
+
+
+def legacy_parse_contract(file):
+    # The original create_contract loop, kept as a reference for the benchmark
+    data = xlrd.open_workbook(file)
+    sheet = data.sheet_by_index(0)
+    labels = CONTRACT_LABELS
+    values = [None for _ in range(len(labels) + 1)]
+    row = sheet.nrows
+    column = sheet.ncols
+    for i in range(row):
+        for j in range(column):
+            for k in range(len(labels)):
+                if sheet.cell(i, j).value == labels[k]:
+                    values[k] = sheet.cell(i + 1, j).value
+
+    if check_date(sheet.cell(1, 5).value):
+        values[-1] = sheet.cell(1, 5).value
+    else:
+        temp = datetime.fromordinal(int(sheet.cell(1, 5).value))
+        temp = datetime(day=temp.day, month=temp.month, year=temp.year + 1900)
+        temp = temp.strftime("%m.%d.%Y")
+        values[-1] = temp
+    return values
+
+
+def legacy_create_payments(connection, data_path):
+    # The original row-by-row payments loader, kept as a reference for the benchmark
+    connection.create_table(type_=settings.PAYMENT_TABLE)
+    insert_query = """INSERT INTO payment VALUES (?, ?, ?, ?)"""
+    excel = xlrd.open_workbook(data_path)
+    sheet = excel.sheet_by_index(0)
+    for data in zip(sheet.col_values(0)[1::], sheet.col_values(1)[1::], sheet.col_values(2)[1::],
+                    sheet.col_values(3)[1::]):
+        values = [None, None, None, None]
+        if check_date(data[1]):
+            values[1] = data[1]
+        else:
+            temp = datetime.fromordinal(int(data[1]))
+            temp = datetime(day=temp.day, month=temp.month, year=temp.year + 1900)
+            temp = temp.strftime("%m.%d.%Y")
+            values[1] = temp
+        values[0] = int(data[0])
+        values[2] = float(data[2])
+        values[3] = float(data[3])
+        connection.cursor.execute(insert_query, values)
+    connection.connection.commit()
+
+
+def legacy_overdue_days(payments_df):
+    # The original per-contract loop of task2/task4, kept as a reference for the benchmark
+    payments_df = payments_df.copy()
+    payments_df['overdue_days'] = -1
+    for contract in payments_df.contract_id.unique():
+        temp_df = payments_df[payments_df.contract_id == contract].sort_values(['payment_date'])
+        index_arr = temp_df.index.tolist()
+        for i in range(1, len(index_arr)):
+            prev_ind = index_arr[i - 1]
+            ind = index_arr[i]
+            if payments_df.loc[ind, 'amount_paid'] < payments_df.loc[ind, 'amount_due']:
+                if payments_df.loc[prev_ind, 'overdue_days'] == -1:
+                    payments_df.loc[ind, 'overdue_days'] = 0
+                else:
+                    new_ov_days = 30
+                    payments_df.loc[ind, 'overdue_days'] = payments_df.loc[prev_ind, 'overdue_days'] + new_ov_days
+            elif payments_df.loc[ind, 'amount_paid'] > payments_df.loc[ind, 'amount_due']:
+                months_covered = int(round(payments_df.loc[ind, 'amount_paid'] / payments_df.loc[ind, 'amount_due'], 0))
+                months_covered = months_covered - 1
+                payments_df.loc[ind, 'overdue_days'] = payments_df.loc[prev_ind, 'overdue_days'] - months_covered * 30
+                if payments_df.loc[ind, 'overdue_days'] < 0:
+                    payments_df.loc[ind, 'overdue_days'] = -1
+    return payments_df.overdue_days
+
+
+def legacy_enrich(payments_df, contracts_df):
+    # The original first payment, contract and age loops of task2, kept as a reference for the benchmark
+    payments_df = payments_df.copy()
+    s_dates = payments_df.groupby(['contract_id'], as_index=False).agg({'payment_date': 'min'})
+    s_dates['amount_due'] = np.nan
+    s_dates['amount_paid'] = np.nan
+    for ind in s_dates.index:
+        row = s_dates.loc[ind]
+        t_df = payments_df[(payments_df.contract_id == row.contract_id) & (payments_df.payment_date == row.payment_date)]
+        s_dates.loc[ind, 'amount_due'] = t_df.amount_due.iloc[0]
+        s_dates.loc[ind, 'amount_paid'] = t_df.amount_paid.iloc[0]
+
+    payments_df['contract_date'] = pd.NaT
+    payments_df['id_number'] = 0
+    for ind in payments_df.index:
+        row = payments_df.loc[ind]
+        payments_df.loc[ind, 'contract_date'] = contracts_df.loc[row.contract_id].contract_date
+        payments_df.loc[ind, 'id_number'] = contracts_df.loc[row.contract_id].id
+
+    payments_df['age'] = 0
+    for contract in payments_df.contract_id.unique():
+        temp_df = payments_df[payments_df.contract_id == contract].sort_values(['payment_date'])
+        index_arr = temp_df.index.tolist()
+        contract_date = temp_df.contract_date.iloc[0]
+        for i in range(0, len(index_arr)):
+            ind = index_arr[i]
+            curr_date = payments_df.loc[ind, 'payment_date']
+            curr_age = (curr_date.year - contract_date.year) * 12 + (curr_date.month - contract_date.month)
+            payments_df.loc[ind, 'age'] = curr_age
+    return s_dates, payments_df
+
+
+def legacy_score_profiles(profile_data):
+    # task3 before the scorecard: nested if/elif per client, the table grown one row at a time
+    def age_category(age):
+        if 18 <= age < 25:
+            return '[18, 25)'
+        elif 25 <= age < 35:
+            return '[25, 35)'
+        elif 35 <= age < 55:
+            return '[35, 55)'
+        elif age != age:
+            return 'None'
+        else:
+            return '[55, inf)'
+
+    def income_category(income):
+        if isinstance(income, str) and not len(income):
+            income = float('nan')
+        else:
+            income = float(income)
+        if income < 40000:
+            return '[0-40000)'
+        elif 40000 <= income < 100000:
+            return '[40000, 100000)'
+        elif 100000 <= income < 200000:
+            return '[100000, 200000)'
+        elif 200000 <= income < 500000:
+            return '[200000, 500000)'
+        elif income != income:
+            return 'None'
+        else:
+            return '[500000, inf)'
+
+    def age_of_car_category(age_of_car):
+        if isinstance(age_of_car, str) and not len(age_of_car):
+            age_of_car = float('nan')
+        else:
+            age_of_car = float(age_of_car)
+        if age_of_car < 1:
+            return '[0, 1)'
+        elif 1 <= age_of_car < 3:
+            return '[1, 3)'
+        elif age_of_car != age_of_car:
+            return 'None'
+        else:
+            return '[3, inf)'
+
+    def score_client(client):
+        def age_score(age):
+            if age == '[18, 25)':
+                return 10
+            elif age == '[25, 35)':
+                return 20
+            elif age == '[35, 55)':
+                return 25
+            elif age == 'None':
+                return 0
+            elif age == '[55, inf)':
+                return 15
+
+        def family_score(family):
+            if family == 1:
+                return 10
+            elif family == 2:
+                return 15
+            elif family == 3:
+                return 25
+            elif family == 4:
+                return 20
+            else:
+                return 0
+
+        def income_score(income):
+            if income == '[0-40000)':
+                return 5
+            elif income == '[40000, 100000)':
+                return 10
+            elif income == '[100000, 200000)':
+                return 15
+            elif income == '[200000, 500000)':
+                return 20
+            elif income == 'None':
+                return 0
+            elif income == '[500000, inf)':
+                return 25
+
+        def house_ownership_score(house_ownership):
+            if house_ownership:
+                return 25
+            else:
+                return 0
+
+        def age_of_car_score(age_of_car):
+                if age_of_car == '[0, 1)':
+                    return 25
+                elif age_of_car == '[1, 3)':
+                    return 15
+                elif age_of_car == 'None':
+                    return 0
+                elif age_of_car == '[3, inf)':
+                    return 5
+
+        def employed_by_score(employed_by):
+            employed_by_score_dict = {
+                "Business Entity Type 3": 25,
+                "Business Entity Type 2": 25,
+                "Government": 20,
+                "Military": 5,
+                "Security Ministries": 15,
+                "Emergency": 5,
+                "Security": 5,
+                "Construction": 5,
+                "Electricity": 5,
+                "XNA": 0,
+                "Other": 0,
+            }
+            return employed_by_score_dict.get(employed_by, 10)
+
+        def education_score(education):
+            if education == "Higher education":
+                return 25
+            elif education == "Secondary / secondary special":
+                return 10
+            elif education == "Incomplete higher":
+                return 20
+            else:
+                return 0
+
+        def marital_status_score(marital_status):
+            if marital_status == "Married":
+                return 25
+            elif marital_status == "Single / not married":
+                return 10
+            elif marital_status == "Civil marriage":
+                return 15
+            elif marital_status == "Widow":
+                return 5
+            elif marital_status == "Separated":
+                return 5
+            else:
+                return 0
+
+        def position_score(position):
+            if position == "Core staff":
+                return 25
+            elif position == "Accountants":
+                return 25
+            elif position == "Managers":
+                return 25
+            elif position == "Security staff":
+                return 10
+            elif position == "<undefined>":
+                return 0
+            else:
+                return 15
+
+        def income_type_score(income_type):
+            if income_type == "State servant":
+                return 15
+            if income_type == "Working":
+                return 10
+            if income_type == "Commercial associate":
+                return 25
+            if income_type == "Pensioner":
+                return 5
+            else:
+                return 0
+
+        def housing_score(housing):
+            if housing == "House / apartment":
+                return 25
+            elif housing == "Rented apartment":
+                return 15
+            elif housing == "With parents":
+                return 10
+            else:
+                return 0
+
+        score_dict = dict()
+        score_dict['age'] = age_score(client.age)
+        score_dict['family'] = family_score(client.family)
+        score_dict['income'] = income_score(client.income)
+        score_dict['house_ownership'] = house_ownership_score(client.house_ownership)
+        score_dict['age_of_car'] = age_of_car_score(client.age_of_car)
+        score_dict['employed_by'] = employed_by_score(client.employed_by)
+        score_dict['education'] = education_score(client.education)
+        score_dict['marital_status'] = marital_status_score(client.marital_status)
+        score_dict['position'] = position_score(client.position)
+        score_dict['income_type'] = income_type_score(client.income_type)
+        score_dict['housing'] = housing_score(client.housing)
+        return score_dict
+
+    profile_data = profile_data.copy()
+    profile_data['age'] = profile_data.age.apply(age_category)
+    profile_data['income'] = profile_data.income.apply(income_category)
+    profile_data['age_of_car'] = profile_data.age_of_car.apply(age_of_car_category)
+
+    score_table = pd.DataFrame([], columns=['id'] + SCORE_COLUMNS)
+    for i in range(len(profile_data)):
+        client = profile_data.iloc[i]
+        score_dict = score_client(client)
+        score_table.loc[i] = [client.id] + [score_dict[column] for column in SCORE_COLUMNS]
+    return score_table
+
+
+def legacy_total_scores(clients_scores):
+    clients_scores = clients_scores.copy()
+    clients_scores['total_score'] = 0.0
+    for ind in clients_scores.index:
+        row = clients_scores.loc[ind]
+        temp_scores = dict()
+        for column_name in SCORE_WEIGHTS.keys():
+            temp_scores[column_name] = row[column_name] * SCORE_WEIGHTS[column_name]
+        clients_scores.loc[ind, 'total_score'] = sum(temp_scores.values())
+    return clients_scores[['id', 'total_score']]
+
+
+def excel_date(number, serial):
+    # Workbooks hold dates either as "%m.%d.%Y" strings or as Excel serial numbers
+    if serial:
+        return float(number)
+    temp = datetime.fromordinal(number)
+    return datetime(day=temp.day, month=temp.month, year=temp.year + 1900).strftime("%m.%d.%Y")
+
+
+def legacy_to_iso(rows, positions):
+    # The legacy code stored "%m.%d.%Y" dates, convert them before comparing with the current output
+    rows = [list(row) for row in rows]
+    for row in rows:
+        for position in positions:
+            if row[position] is not None:
+                row[position] = datetime.strptime(row[position], settings.SOURCE_DATE_FORMAT).strftime(
+                    settings.DATE_FORMAT)
+    return rows
+
+
+def random_date(rng, serial):
+    return excel_date(rng.randint(20000, 43000), serial)
+
+
+def contract_start(contract_id):
+    # Serial number of the contract date; the first payment falls a month later
+    return 41000 + contract_id * 7919 % 1000
+
+
+def write_workbook(file_name, cells):
+    import xlwt
+
+    book = xlwt.Workbook()
+    sheet = book.add_sheet("Sheet1")
+    for (i, j), value in cells.items():
+        sheet.write(i, j, value)
+    book.save(file_name)
+
+
+def generate_profile(file_name, client_id, rng):
+    values = [client_id,
+              random_date(rng, rng.random() < 0.5),
+              rng.choice(["Female", "Male"]),
+              rng.choice(["Services", "Government", "Medicine", "XNA", "Other"]),
+              random_date(rng, rng.random() < 0.5),
+              rng.choice(["Higher education", "Incomplete higher", "Secondary / secondary special"]),
+              rng.randint(0, 3),
+              rng.randint(1, 5),
+              rng.choice(["Married", "Single / not married", "Widow"]),
+              rng.choice(["Managers", "Laborers", "Core staff", "Drivers"]),
+              rng.choice(["House / apartment", "Rented apartment", "With parents"]),
+              rng.randint(20000, 600000),
+              rng.choice([0, rng.randint(1, 10)]),
+              rng.choice(["Y", "N"]),
+              rng.choice(["Working", "Pensioner", "State servant"])]
+    # Two blocks of "label above value", padded with notes like a real applicant form
+    cells = {(0, 0): "Application form"}
+    for k, (label, value) in enumerate(zip(PROFILE_LABELS, values)):
+        block, column = divmod(k, 8)
+        cells[(2 + block * 4, column)] = label
+        cells[(3 + block * 4, column)] = value
+    for i in range(10, 30):
+        cells[(i, 0)] = "Note %d" % i
+    write_workbook(file_name, cells)
+
+
+def generate_contract(file_name, client_id, contract_id, rng):
+    labels = CONTRACT_LABELS[:5] + ["Contract Date", CONTRACT_LABELS[5]]
+    values = [client_id,
+              contract_id,
+              rng.randint(10000, 500000),
+              rng.choice(["Cash loans", "Revolving loans"]),
+              rng.choice([6, 12, 24, 36]),
+              excel_date(contract_start(contract_id), rng.random() < 0.5),
+              rng.randint(1000, 30000)]
+    cells = dict()
+    for j, (label, value) in enumerate(zip(labels, values)):
+        cells[(0, j)] = label
+        cells[(1, j)] = value
+    write_workbook(file_name, cells)
+
+
+def generate_payments(file_name, contracts, months, rng):
+    # One payment a month per contract: mostly on time, some missed, some covering several months.
+    # A fifth of the contracts miss often enough to reach 90+ days overdue.
+    cells = dict()
+    for j, label in enumerate(["Contract Number", "Payment Date", "Amount Due", "Amount Paid"]):
+        cells[(0, j)] = label
+    row = 1
+    for n in range(contracts):
+        start = contract_start(200000 + n) + 30
+        miss = 0.6 if rng.random() < 0.2 else 0.1
+        for month in range(months):
+            outcome = rng.random()
+            amount_paid = 0.0 if outcome < miss else 1000.0 * rng.choice([2, 3]) if outcome < miss + 0.1 else 1000.0
+            cells[(row, 0)] = 200000 + n
+            cells[(row, 1)] = excel_date(start + 30 * month, rng.random() < 0.8)
+            cells[(row, 2)] = 1000.0
+            cells[(row, 3)] = amount_paid
+            row += 1
+    write_workbook(file_name, cells)
+
+
+def generate_data(data_path, profiles, contracts, months=0, seed=0):
+    rng = random.Random(seed)
+    profile_dir = os.path.join(data_path, "profile")
+    contract_dir = os.path.join(data_path, "contracts")
+    os.makedirs(profile_dir, exist_ok=True)
+    os.makedirs(contract_dir, exist_ok=True)
+    for n in range(profiles):
+        generate_profile(os.path.join(profile_dir, "A%d.xls" % (100000 + n)), 100000 + n, rng)
+    for n in range(contracts):
+        client_id = 100000 + n % max(profiles, 1)
+        generate_contract(os.path.join(contract_dir, "C%d.xls" % (200000 + n)), client_id, 200000 + n, rng)
+    if months:
+        generate_payments(os.path.join(data_path, "payments.xls"), contracts, months, rng)
+
+
+def generate_payment_frame(rows, months, seed=0):
+    # Monthly payments in shuffled order; partial, exact, missing and multi-month
+    # (including x.5 ratios, which round half to even) payments
+    rng = np.random.RandomState(seed)
+    contracts = max(rows // months, 1)
+    contract_ids = np.repeat(np.arange(200000, 200000 + contracts), months)
+    dates = (np.datetime64("2015-01-01") + np.tile(np.arange(months) * 30, contracts)).astype("datetime64[ns]")
+    due = rng.choice([500.0, 1000.0], len(contract_ids))
+    ratios = rng.choice([0.0, 0.0, 0.5, 1.0, 1.0, 1.0, 1.2, 1.5, 2.0, 2.5, 3.0, 6.0, np.nan], len(contract_ids))
+    # Some contracts are much worse payers, so the overdue gets past 90 days
+    bad = np.repeat(rng.random_sample(contracts) < 0.2, months) & (rng.random_sample(len(contract_ids)) < 0.5)
+    ratios[bad] = 0.0
+    frame = pd.DataFrame({"contract_id": contract_ids, "payment_date": dates,
+                          "amount_due": due, "amount_paid": due * ratios})
+    return frame.sample(frac=1, random_state=rng).reset_index(drop=True)
+
+
+def generate_contract_frame(payments_df, seed=0):
+    # Contract table (indexed by contract_id) for the generated payments, signed 0-40 days before the first one
+    rng = np.random.RandomState(seed)
+    contract_ids = np.unique(payments_df.contract_id.values)
+    first = payments_df.groupby("contract_id").payment_date.min().reindex(contract_ids).values
+    contract_dates = first - rng.randint(0, 40, len(contract_ids)).astype("timedelta64[D]")
+    return pd.DataFrame({"id": 100000 + rng.randint(0, max(len(contract_ids) // 2, 1), len(contract_ids)),
+                         "contract_date": contract_dates}, index=pd.Index(contract_ids, name="contract_id"))
+
+
+def bench_payments(args):
+    data_path = tempfile.mkdtemp(prefix="bench_payments_")
+    try:
+        file_name = args.file
+        if not file_name:
+            file_name = os.path.join(data_path, "payments.xls")
+            print("Generating %d payments in %s" % (args.contracts * args.months, file_name))
+            generate_payments(file_name, args.contracts, args.months, random.Random(0))
+
+        timings = []
+        tables = []
+        for name, loader in (("legacy", legacy_create_payments), ("chunked", create_payments)):
+            db_path = os.path.join(data_path, "%s.db" % name)
+            connection = DBhandler(db_path=db_path)
+            start = time.perf_counter()
+            loader(connection, file_name)
+            timings.append(time.perf_counter() - start)
+            tables.append(connection.cursor.execute("SELECT * FROM payment ORDER BY rowid").fetchall())
+            connection.connection.close()
+        if legacy_to_iso(tables[0], [1]) != legacy_to_iso(tables[1], []):
+            raise Exception("Payment loaders disagree on %s" % file_name)
+        rows = len(tables[1])
+        print("payments %8d rows  legacy %8.3fs (%d rows/sec)  chunked %8.3fs (%d rows/sec)"
+              % (rows, timings[0], rows / timings[0], timings[1], rows / timings[1]))
+    finally:
+        shutil.rmtree(data_path)
+
+
+def bench_overdue(args):
+    check_df = generate_payment_frame(args.check_rows, args.months, seed=1)
+    start = time.perf_counter()
+    expected = legacy_overdue_days(check_df)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = overdue_days(check_df)
+    check_time = time.perf_counter() - start
+    if not result.equals(expected.rename("overdue_days")):
+        mismatches = check_df[result != expected]
+        raise Exception("Overdue engines disagree on %d rows:\n%s" % (len(mismatches), mismatches.head()))
+    print("check    %8d rows  legacy %8.3fs  vectorized %8.3fs  (%d defaults at 90 days)"
+          % (len(check_df), legacy_time, check_time, (expected == 90).sum()))
+
+    payments_df = generate_payment_frame(args.rows, args.months)
+    start = time.perf_counter()
+    overdue_days(payments_df)
+    elapsed = time.perf_counter() - start
+    print("overdue  %8d rows  vectorized %8.3fs (%d rows/sec)" % (len(payments_df), elapsed, len(payments_df) / elapsed))
+
+
+def enrich(payments_df, contracts_df):
+    payments_df = payments_df.copy()
+    return first_payments(payments_df), add_contract_columns(payments_df, contracts_df)
+
+
+def bench_enrich(args):
+    check_df = generate_payment_frame(args.check_rows, args.months, seed=1)
+    check_contracts = generate_contract_frame(check_df, seed=1)
+    start = time.perf_counter()
+    old_first, old_df = legacy_enrich(check_df, check_contracts)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    new_first, new_df = enrich(check_df, check_contracts)
+    check_time = time.perf_counter() - start
+    columns = ["contract_date", "id_number", "age"]
+    if not (old_first.reset_index(drop=True).equals(new_first.reset_index(drop=True)) and
+            np.array_equal(old_df[columns].values.astype(str), new_df[columns].values.astype(str))):
+        raise Exception("Enrichment disagrees with the legacy loops")
+    print("check    %8d rows  legacy %8.3fs  vectorized %8.3fs" % (len(check_df), legacy_time, check_time))
+
+    payments_df = generate_payment_frame(args.rows, args.months)
+    contracts_df = generate_contract_frame(payments_df)
+    start = time.perf_counter()
+    enrich(payments_df, contracts_df)
+    elapsed = time.perf_counter() - start
+    print("enrich   %8d rows  vectorized %8.3fs (%d rows/sec)" % (len(payments_df), elapsed, len(payments_df) / elapsed))
+
+
+def loop_roll_rates(payments_df, types):
+    # Straightforward per contract walk: {(month, type, from, to): contracts}
+    counts = dict()
+    previous = dict()
+    for row in payments_df.sort_values(["contract_id", "payment_date"], kind="mergesort").itertuples():
+        od = row.overdue_days
+        bucket = "current" if od < 0 else "0" if od < 30 else "30" if od < 60 else "60" if od < 90 else "90+"
+        if row.contract_id in previous:
+            key = (str(row.payment_date)[:7], types.get(row.contract_id, "Unknown"), previous[row.contract_id], bucket)
+            counts[key] = counts.get(key, 0) + 1
+        previous[row.contract_id] = bucket
+    return counts
+
+
+def bench_rollrates(args):
+    check_df = generate_payment_frame(args.check_rows, args.months, seed=1)
+    check_df["overdue_days"] = overdue_days(check_df)
+    contract_ids = np.unique(check_df.contract_id.values)
+    types = pd.Series(np.random.RandomState(1).choice(["Cash loans", "Revolving loans"], len(contract_ids)),
+                      index=contract_ids)
+    start = time.perf_counter()
+    expected = loop_roll_rates(check_df, types)
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    rates = roll_rates(check_df, types)
+    check_time = time.perf_counter() - start
+    result = dict(zip(zip(rates.month, rates.contract_type, rates.from_bucket, rates.to_bucket), rates.contracts))
+    if result != expected or not set(rates.from_bucket) <= set(BUCKETS):
+        raise Exception("Roll rates disagree with the per contract loop")
+    print("check    %8d rows  loop %8.3fs  vectorized %8.3fs  (%d transitions)"
+          % (len(check_df), loop_time, check_time, rates.contracts.sum()))
+
+    payments_df = generate_payment_frame(args.rows, args.months)
+    payments_df["overdue_days"] = overdue_days(payments_df)
+    contract_ids = np.unique(payments_df.contract_id.values)
+    types = pd.Series(np.random.RandomState(0).choice(["Cash loans", "Revolving loans"], len(contract_ids)),
+                      index=contract_ids)
+    start = time.perf_counter()
+    rates = roll_rates(payments_df, types)
+    elapsed = time.perf_counter() - start
+    print("rollrates %7d rows  vectorized %8.3fs (%d rows/sec, %d matrix cells)"
+          % (len(payments_df), elapsed, len(payments_df) / elapsed, len(rates)))
+
+
+def payment_database(db_path, rows, months, same_month=0.0):
+    # SQLite database with the generated payment and contract tables. A same_month share of the
+    # payments is moved 25 days back, mostly into the month of the previous payment.
+    payments_df = generate_payment_frame(rows, months)
+    moved = np.random.RandomState(1).random_sample(len(payments_df)) < same_month
+    payments_df.loc[moved, "payment_date"] -= pd.Timedelta(days=25)
+    contracts_df = generate_contract_frame(payments_df)
+    connection = get_connection(db_path)
+    with connection.transaction():
+        connection.create_table(type_=settings.PAYMENT_TABLE)
+        connection.create_table(type_=settings.CONTRACT_TABLE)
+        connection.cursor.executemany("INSERT INTO payment VALUES (?, ?, ?, ?)", zip(
+            payments_df.contract_id.tolist(), payments_df.payment_date.dt.strftime(settings.DATE_FORMAT).tolist(),
+            payments_df.amount_due.tolist(), payments_df.amount_paid.where(payments_df.amount_paid.notnull(), None).tolist()))
+        connection.cursor.executemany("INSERT INTO contract (id, contract_id, contract_date) VALUES (?, ?, ?)", zip(
+            contracts_df.id.tolist(), contracts_df.index.tolist(),
+            contracts_df.contract_date.dt.strftime(settings.DATE_FORMAT).tolist()))
+    return connection
+
+
+def peak_memory(function, *args):
+    # Result, seconds and peak of the memory allocated by the call in MiB
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def in_memory_performance(connection):
+    performance_df = compute_performance(connection)
+    store_performance(connection, performance_df, 0)
+    return performance_df
+
+
+def bench_stream(args):
+    data_path = tempfile.mkdtemp(prefix="bench_stream_")
+    try:
+        connection = payment_database(os.path.join(data_path, "stream.db"), args.rows, args.months, same_month=0.2)
+        # Every age, so contracts with two payments in one month pick the same one on both paths
+        ages = list(range(args.months + 2))
+        expected, memory_time, memory_peak = peak_memory(in_memory_performance, connection)
+        memory_matrix = default_matrix(horizon_payments(connection, ages), load_default_dates(connection), ages)
+        _, stream_time, stream_peak = peak_memory(stream_performance, connection, args.chunk_size)
+        if not default_matrix(horizon_payments(connection, ages), load_default_dates(connection), ages).equals(memory_matrix):
+            raise Exception("Default flags of the streamed loan performance differ from the in-memory ones")
+
+        streamed = pd.read_sql_query("SELECT * FROM %s ORDER BY rowid" % settings.LOAN_PERFORMANCE_TABLE,
+                                     connection.connection, parse_dates=["payment_date", "contract_date"])
+        expected = expected.sort_values(["contract_id", "payment_date"], kind="mergesort").reset_index(drop=True)
+        stored_dates = pd.read_sql_query("SELECT * FROM %s ORDER BY contract_id" % settings.DEFAULT_DATES_TABLE,
+                                         connection.connection, parse_dates=["payment_date"])
+        if not (streamed.astype(str).equals(expected.astype(str)) and
+                stored_dates.equals(default_dates(expected).reset_index(drop=True))):
+            raise Exception("Streamed loan performance differs from the in-memory one")
+        # The block readers give what the functions give on the whole frame
+        types = pd.Series(dtype=object)
+        if not (load_first_payments(connection, args.chunk_size).astype(str).equals(
+                    first_payments(expected).reset_index(drop=True).astype(str)) and
+                performance_roll_rates(connection, types, args.chunk_size).equals(roll_rates(expected, types))):
+            raise Exception("Loan performance read in blocks differs from the whole frame")
+        rows = len(expected)
+        print("in memory %7d rows %8.3fs  peak %8.1f MiB" % (rows, memory_time, memory_peak))
+        print("streamed  %7d rows %8.3fs  peak %8.1f MiB  (chunks of %d, %d defaults)"
+              % (rows, stream_time, stream_peak, args.chunk_size, len(stored_dates)))
+    finally:
+        shutil.rmtree(data_path)
+
+
+def generate_profile_frame(rows, seed=0):
+    # Decoded profiles with every scorecard value plus unknown, missing and empty ones
+    rng = np.random.RandomState(seed)
+    columns = {"id": np.arange(100000, 100000 + rows),
+               "age": rng.choice([np.nan, 10, 17, 18, 24, 25, 34, 35, 54, 55, 80], rows),
+               "family": rng.choice([np.nan, 0, 1, 2, 3, 4, 5], rows),
+               "income": rng.choice(["", 0, 39999, 40000, 99999, 100000, 199999, 200000, 499999, 500000, 10 ** 7], rows),
+               "age_of_car": rng.choice(["", 0, 0.5, 1, 2, 3, 20], rows),
+               "house_ownership": rng.choice(np.array([np.nan, None, "", 0, 1], dtype=object), rows)}
+    for rule in SCORECARD:
+        if "categories" in rule and rule["feature"] != "family":
+            labels = list(rule["categories"]) + ["Unknown label"]
+            columns[rule["feature"]] = pd.Categorical.from_codes(rng.randint(-1, len(labels), rows), labels)
+    return pd.DataFrame(columns)
+
+
+def bench_scorecard(args):
+    check_df = generate_profile_frame(args.check_rows, seed=1)
+    start = time.perf_counter()
+    expected = legacy_score_profiles(check_df)
+    expected_totals = legacy_total_scores(expected)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    points = score_points(check_df)
+    totals = total_scores(points)
+    check_time = time.perf_counter() - start
+    if not (np.array_equal(points.values, expected.values.astype(np.int64)) and
+            np.array_equal(totals.total_score.values, expected_totals.total_score.values.astype(float))):
+        raise Exception("Scorecard disagrees with the legacy scoring")
+    print("check    %8d rows  legacy %8.3fs  scorecard %8.3fs" % (len(check_df), legacy_time, check_time))
+
+    profile_df = generate_profile_frame(args.rows)
+    start = time.perf_counter()
+    total_scores(score_points(profile_df))
+    elapsed = time.perf_counter() - start
+    print("scorecard %7d rows  %8.3fs (%d rows/sec)" % (len(profile_df), elapsed, len(profile_df) / elapsed))
+
+
+def applicant_records(profile_df):
+    # Rows of a decoded profile frame as the dicts an application arrives as
+    columns = [profile_df[column].astype(object).values for column in profile_df.columns]
+    return [dict(zip(profile_df.columns, row)) for row in zip(*columns)]
+
+
+def latencies(function, jobs, concurrency):
+    # Seconds of every call of function(job), made from concurrency threads at once
+    def timed(job):
+        start = time.perf_counter()
+        function(job)
+        return time.perf_counter() - start
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return np.array(list(executor.map(timed, jobs)))
+
+
+def print_latencies(name, timings, elapsed, concurrency):
+    print("%-10s %7d calls  %2d threads  p50 %8.1fus  p99 %8.1fus  %8d calls/sec"
+          % (name, len(timings), concurrency, np.percentile(timings, 50) * 1e6,
+             np.percentile(timings, 99) * 1e6, len(timings) / elapsed))
+
+
+def bench_applicant(args):
+    check_df = generate_profile_frame(args.check_rows, seed=1)
+    expected = score_points(check_df)
+    expected["total_score"] = total_scores(expected).total_score
+    for record, row in zip(applicant_records(check_df), expected.itertuples(index=False)):
+        result = score_applicant(record)
+        if [result["points"][column] for column in SCORE_COLUMNS] != list(row[1:-1]) or result["total_score"] != row[-1]:
+            raise Exception("Single applicant scoring disagrees with the scorecard on %s" % record)
+    print("check    %8d applicants scored like score_points" % len(check_df))
+
+    records = applicant_records(generate_profile_frame(args.requests))
+    start = time.perf_counter()
+    timings = latencies(score_applicant, records, args.concurrency)
+    print_latencies("in-process", timings, time.perf_counter() - start, args.concurrency)
+
+    server = ScoringServer(("127.0.0.1", 0), ScoringHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connections = threading.local()
+
+    def post(record):
+        # One keep-alive connection per client thread
+        if not hasattr(connections, "connection"):
+            connections.connection = http.client.HTTPConnection(*server.server_address[:2])
+        body = json.dumps({key: None if value != value else value for key, value in record.items()
+                           if key != "id"}, default=int)
+        connections.connection.request("POST", "/score", body, {"Content-Type": "application/json"})
+        response = connections.connection.getresponse()
+        if response.status != 200:
+            raise Exception("Scoring endpoint answered %d: %s" % (response.status, response.read()))
+        return json.loads(response.read())
+
+    try:
+        http_records = records[:args.http_requests]
+        start = time.perf_counter()
+        timings = latencies(post, http_records, args.concurrency)
+        print_latencies("http", timings, time.perf_counter() - start, args.concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def profile_database(connection, rows, seed=0):
+    # Profile table with the scorecard columns coded through values_map, as task1 leaves it
+    rng = np.random.RandomState(seed)
+    birth = np.datetime64("1950-01-01") + rng.randint(0, 50 * 365, rows).astype("timedelta64[D]")
+    columns = {"id": np.arange(100000, 100000 + rows).tolist(),
+               "birth": np.datetime_as_string(birth).tolist(),
+               "gender": rng.choice(["0", "1"], rows).tolist(),
+               "children": rng.randint(0, 4, rows).tolist(),
+               "family": rng.randint(1, 6, rows).tolist(),
+               "income": rng.randint(20000, 600000, rows).tolist(),
+               "age_of_car": rng.choice([None, 0, 1, 2, 3, 20], rows).tolist(),
+               "house_ownership": rng.randint(0, 2, rows).tolist()}
+    labels = dict((rule["feature"], list(rule["categories"])) for rule in SCORECARD
+                  if "categories" in rule and rule["feature"] != "family")
+    for column, values in labels.items():
+        # Labels outside the map stay as they are, like unknown values in the workbooks
+        columns[column] = rng.choice(values + ["Unknown label"], rows).tolist()
+    with connection.transaction():
+        connection.create_table(type_=settings.PROFILE_TABLE)
+        connection.cursor.executemany("INSERT INTO profile (%s) VALUES (%s)" % (", ".join(columns), ", ".join("?" * len(columns))),
+                                      zip(*columns.values()))
+        for column, values in labels.items():
+            connection.create_map(values_map=dict((label, code) for code, label in enumerate(values)),
+                                  target_table=settings.PROFILE_TABLE, target_column=column)
+
+
+def loose_frame(df):
+    # The frame in the dtypes pandas reads from SQLite: labels as Python strings, integers as int64
+    df = df.copy()
+    for column in df.columns:
+        dtype = df[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            # Bins (intervals) stay categorical, numbers go back to their dtype
+            if dtype.categories.dtype.kind in "iuf":
+                df[column] = df[column].astype(dtype.categories.dtype)
+            elif not isinstance(dtype.categories, pd.IntervalIndex):
+                df[column] = df[column].astype(object)
+        elif dtype.kind in "iu":
+            df[column] = df[column].astype(np.int64)
+    return df
+
+
+def frame_memory(df):
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def bench_memory(args):
+    data_path = tempfile.mkdtemp(prefix="bench_memory_")
+    try:
+        connection = payment_database(os.path.join(data_path, "memory.db"), args.payments, args.months)
+        profile_database(connection, args.profiles)
+        refresh_performance(connection)
+        profile_df = prepare_profiles(connection, pd.read_sql_query("SELECT * FROM %s" % settings.PROFILE_TABLE,
+                                                                    connection.connection, parse_dates=["birth"]))
+        frames = [
+            ("profiles", profile_df),
+            ("scores", score_points(profile_df)),
+            ("applications", load_applications(connection, [])),
+            ("horizons", horizon_payments(connection, settings.DEFAULT_HORIZONS)),
+            ("block", next(performance_blocks(connection))),
+        ]
+        print("%-12s %8s %10s %10s %7s" % ("frame", "rows", "before MiB", "after MiB", "saved"))
+        for name, frame in frames:
+            before_size, after_size = frame_memory(loose_frame(frame)), frame_memory(frame)
+            print("%-12s %8d %10.1f %10.1f %6.0f%%" % (name, len(frame), before_size, after_size,
+                                                       100 * (1 - after_size / before_size)))
+            print("    " + ", ".join("%s %s" % (column, dtype.name) for column, dtype in frame.dtypes.items()))
+    finally:
+        shutil.rmtree(data_path)
+
+
+def import_time(module):
+    # A fresh interpreter per measurement, so nothing is cached in sys.modules
+    code = ("import sys, time; start = time.perf_counter(); import %s; "
+            "print(time.perf_counter() - start); print(' '.join(sys.modules))" % module)
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed, modules = output.decode().strip().split("\n")[-2:]
+    return float(elapsed), set(modules.split())
+
+
+def bench_startup(args):
+    failed = []
+    for module, forbidden, budget in STARTUP_MODULES:
+        timings = []
+        for _ in range(args.repeat):
+            elapsed, modules = import_time(module)
+            timings.append(elapsed)
+        elapsed = min(timings)
+        loaded = [name for name in forbidden if name in modules]
+        over = budget is not None and elapsed > budget * args.scale
+        if loaded or over:
+            failed.append(module)
+        print("%-4s import %-8s %7.3fs%s%s" % ("FAIL" if loaded or over else "ok", module, elapsed,
+                                               "  budget %.2fs" % (budget * args.scale) if budget is not None else "",
+                                               "  loads " + ", ".join(loaded) if loaded else ""))
+    if failed:
+        raise Exception("Startup regressed for: %s" % ", ".join(failed))
+
+
+def query_plan(connection, sql, params):
+    connection.cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [row[-1] for row in connection.cursor.fetchall()]
+
+
+def check_plans(args):
+    connection = get_connection(args.db)
+    for type_ in (settings.PROFILE_TABLE, settings.CONTRACT_TABLE, settings.PAYMENT_TABLE, settings.VALUES_MAP_TABLE):
+        connection.create_table(type_=type_)
+    failed = 0
+    for sql, params, expected in HOT_QUERIES:
+        plan = query_plan(connection, sql, params)
+        # Older SQLite versions print SCAN TABLE/SEARCH TABLE
+        text = " | ".join(plan).replace(" TABLE ", " ")
+        ok = all(part in text for part in expected) and "USE TEMP B-TREE" not in text
+        failed += not ok
+        print("%-4s %s\n     %s" % ("ok" if ok else "FAIL", sql, text))
+    if failed:
+        raise Exception("%d queries do not use an index" % failed)
+
+
+def time_parser(parser, directory):
+    start = time.perf_counter()
+    result = [parser(os.path.join(directory, file_name)) for file_name in sorted(os.listdir(directory))]
+    return result, time.perf_counter() - start
+
+
+def bench_parse(args):
+    data_path = args.data or tempfile.mkdtemp(prefix="bench_parse_")
+    try:
+        if not args.data:
+            print("Generating %d profiles and %d contracts in %s" % (args.profiles, args.contracts, data_path))
+            generate_data(data_path, args.profiles, args.contracts)
+
+        for name, legacy, current, dates in (("profile", legacy_parse_profile, parse_profile, [1, 4]),
+                                             ("contracts", legacy_parse_contract, parse_contract, [-1])):
+            directory = os.path.join(data_path, name)
+            old_rows, old_time = time_parser(legacy, directory)
+            new_rows, new_time = time_parser(current, directory)
+            if legacy_to_iso(old_rows, dates) != new_rows:
+                raise Exception("Parsers disagree on %s" % directory)
+            print("%-10s %6d files  legacy %8.3fs  indexed %8.3fs  speedup x%.1f"
+                  % (name, len(new_rows), old_time, new_time, old_time / max(new_time, 1e-9)))
+
+        db_path = tempfile.mkdtemp(prefix="bench_ingest_")
+        try:
+            timings = []
+            tables = []
+            for workers in (1, args.workers):
+                start = time.perf_counter()
+                tables.append(ingest_tables(os.path.join(db_path, "workers%d.db" % workers), data_path, workers))
+                timings.append(time.perf_counter() - start)
+        finally:
+            shutil.rmtree(db_path)
+        for table in tables[0]:
+            if tables[0][table] != tables[1][table]:
+                raise Exception("Ingest with %d workers differs from the sequential one in %s" % (args.workers, table))
+        print("ingest     1 worker %8.3fs  %d workers %8.3fs  same rows and manifest"
+              % (timings[0], args.workers, timings[1]))
+    finally:
+        if not args.data and not args.keep:
+            shutil.rmtree(data_path)
+
+
+def ingest_tables(db_path, data_path, workers):
+    # The profile, contract and manifest rows of an ingest of data_path into a new database
+    connection = DBhandler(db_path=db_path)
+    create_profile(connection, data_path, workers)
+    create_contract(connection, data_path, workers)
+    tables = {}
+    for table, order in ((settings.PROFILE_TABLE, "id"), (settings.CONTRACT_TABLE, "contract_id"),
+                         (settings.MANIFEST_TABLE, "path")):
+        tables[table] = connection.cursor.execute("SELECT * FROM %s ORDER BY %s" % (table, order)).fetchall()
+    connection.connection.close()
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+
+    parse = commands.add_parser("parse", help="compare the legacy and indexed workbook parsers")
+    parse.add_argument("--data", help="existing directory with profile/ and contracts/ (generated if omitted)")
+    parse.add_argument("--profiles", type=int, default=500)
+    parse.add_argument("--contracts", type=int, default=500)
+    parse.add_argument("--keep", action="store_true", help="keep the generated workbooks")
+    parse.add_argument("--workers", type=int, default=2, help="ingest compared with the sequential one")
+    parse.set_defaults(func=bench_parse)
+
+    payments = commands.add_parser("payments", help="compare the row-by-row and chunked payment loaders")
+    payments.add_argument("--file", help="existing payments workbook (generated if omitted)")
+    payments.add_argument("--contracts", type=int, default=2000)
+    payments.add_argument("--months", type=int, default=30)
+    payments.set_defaults(func=bench_payments)
+
+    plans = commands.add_parser("plans", help="check that the hot queries use the indexes")
+    plans.add_argument("--db", help="database to check (default: settings.DATABASE_PATH)")
+    plans.set_defaults(func=check_plans)
+
+    overdue = commands.add_parser("overdue", help="check the vectorized overdue days against the legacy loop")
+    overdue.add_argument("--rows", type=int, default=1000000)
+    overdue.add_argument("--check-rows", type=int, default=5000, help="rows compared with the (slow) legacy loop")
+    overdue.add_argument("--months", type=int, default=24)
+    overdue.set_defaults(func=bench_overdue)
+
+    enrich_ = commands.add_parser("enrich", help="check the first payment, contract and age columns against the legacy loops")
+    enrich_.add_argument("--rows", type=int, default=1000000)
+    enrich_.add_argument("--check-rows", type=int, default=2000, help="rows compared with the (slow) legacy loops")
+    enrich_.add_argument("--months", type=int, default=24)
+    enrich_.set_defaults(func=bench_enrich)
+
+    rollrates = commands.add_parser("rollrates", help="check the roll rate counts against a per contract loop")
+    rollrates.add_argument("--rows", type=int, default=1000000)
+    rollrates.add_argument("--check-rows", type=int, default=20000, help="rows compared with the loop")
+    rollrates.add_argument("--months", type=int, default=24)
+    rollrates.set_defaults(func=bench_rollrates)
+
+    stream = commands.add_parser("stream", help="compare the peak memory of the in-memory and streamed loan performance")
+    stream.add_argument("--rows", type=int, default=1000000)
+    stream.add_argument("--months", type=int, default=24)
+    stream.add_argument("--chunk-size", dest="chunk_size", type=int, default=settings.STREAM_CHUNK_SIZE)
+    stream.set_defaults(func=bench_stream)
+
+    scorecard = commands.add_parser("scorecard", help="check the scorecard points and totals against the legacy loops")
+    scorecard.add_argument("--rows", type=int, default=1000000)
+    scorecard.add_argument("--check-rows", type=int, default=3000, help="rows compared with the (slow) legacy loops")
+    scorecard.set_defaults(func=bench_scorecard)
+
+    applicant = commands.add_parser("applicant", help="single applicant scoring latency, in process and over HTTP")
+    applicant.add_argument("--requests", type=int, default=100000, help="in-process scorings")
+    applicant.add_argument("--http-requests", dest="http_requests", type=int, default=5000)
+    applicant.add_argument("--concurrency", type=int, default=8, help="threads sending applications at once")
+    applicant.add_argument("--check-rows", type=int, default=20000, help="applicants compared with score_points")
+    applicant.set_defaults(func=bench_applicant)
+
+    memory = commands.add_parser("memory", help="memory of the pipeline frames with and without the compact dtypes")
+    memory.add_argument("--profiles", type=int, default=1000000)
+    memory.add_argument("--payments", type=int, default=1000000)
+    memory.add_argument("--months", type=int, default=24)
+    memory.set_defaults(func=bench_memory)
+
+    startup = commands.add_parser("startup", help="check that the entry points import fast and without heavy modules")
+    startup.add_argument("--repeat", type=int, default=3, help="imports per module, the fastest one counts")
+    startup.add_argument("--scale", type=float, default=1.0, help="multiplier of the time budgets for slow machines")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    if not getattr(args, "func", None):
+        parser.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
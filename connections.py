@@ -0,0 +1,33 @@
+"""
+Shared SQLite connections: one tuned connection per thread and database,
+migrated once per process.
+"""
+import os
+import threading
+
+import settings
+from general import DBhandler
+from migrations import migrate
+
+_local = threading.local()
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def get_connection(db_path=None):
+    db_path = db_path or settings.DATABASE_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = dict()
+    if db_path not in connections:
+        if not os.path.exists(os.path.dirname(db_path) or "."):
+            os.makedirs(os.path.dirname(db_path))
+        connection = DBhandler(db_path=db_path)
+        connection.apply_pragmas(settings.SQLITE_PRAGMAS)
+        with _migrate_lock:
+            if db_path not in _migrated:
+                migrate(connection)
+                _migrated.add(db_path)
+        connections[db_path] = connection
+    return connections[db_path]
+
@@ -1,6 +1,11 @@
 import xlrd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import os
+import time
+import manifest
 import settings
 
 
@@ -11,6 +16,9 @@ class DBhandler:
         if not db_path:
             raise Exception("db_path is required")
 
+        self.type_ = type_
+        self.db_path = db_path
+        self.transaction_depth = 0
         if type_ == "pyodbc":
             import pyodbc
             conection_config = "DRIVER={SQLite3 ODBC Driver};SERVER=localhost;DATABASE=%s;Trusted_connection=yes" % db_path
@@ -26,15 +34,47 @@ class DBhandler:
     def execute_sql(self, raw_sql, commit=False):
         self.cursor.execute(raw_sql)
         if commit:
+            self.commit()
+
+    def commit(self):
+        # Inside transaction() the commit is left to the end of the outermost block
+        if not self.transaction_depth:
+            self.connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block as one transaction: it commits once at the end of the
+        outermost block and rolls back if the block raises
+        """
+        if not self.transaction_depth:
+            self.connection.commit()
+            self.cursor.execute("BEGIN")
+        self.transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.transaction_depth -= 1
+            if not self.transaction_depth:
+                self.connection.rollback()
+            raise
+        self.transaction_depth -= 1
+        if not self.transaction_depth:
             self.connection.commit()
 
-    def create_table(self, type_=None):
+    def apply_pragmas(self, pragmas):
+        if self.type_ != "sqlite3":
+            return
+        for name, value in pragmas:
+            self.cursor.execute("PRAGMA %s = %s" % (name, value))
+
+    def create_table(self, type_=None, commit=True):
         if not type_:
             raise Exception("type_ is required")
         if type_ == settings.PROFILE_TABLE:
-            sql_query = """CREATE TABLE IF NOT EXISTS profile
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS profile
             (
-                id INTEGER NOT NULL,
+                id INTEGER NOT NULL PRIMARY KEY,
                 birth TEXT,
                 gender TEXT,
                 employed_by TEXT,
@@ -49,57 +89,141 @@ class DBhandler:
                 age_of_car INTEGER,
                 house_ownership INTEGER,
                 income_type TEXT
-            )"""
+            )"""]
         elif type_ == settings.CONTRACT_TABLE:
-            sql_query = """CREATE TABLE IF NOT EXISTS contract
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS contract
             (
                 id INTEGER NOT NULL,
-                contract_id INTEGER,
+                contract_id INTEGER NOT NULL PRIMARY KEY,
                 amount INTEGER,
                 type TEXT,
                 month_term INTEGER,
                 annuity INTEGER,
                 contract_date TEXT
-            )"""
+            )""",
+                           """CREATE INDEX IF NOT EXISTS contract_id_idx ON contract (id)"""]
         elif type_ == settings.PAYMENT_TABLE:
-            sql_query = """CREATE TABLE IF NOT EXISTS payment
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS payment
             (
                 contract_id INTEGER NOT NULL,
                 payment_date TEXT,
                 amount_due REAL,
                 amount_paid REAL
             )
-            """
+            """,
+                           """CREATE INDEX IF NOT EXISTS payment_contract_date_idx ON payment (contract_id, payment_date)"""]
+        elif type_ == settings.VALUES_MAP_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS values_map (key TEXT, value INTEGER, table_name TEXT, column_name TEXT)""",
+                           """CREATE INDEX IF NOT EXISTS values_map_column_value_idx ON values_map (column_name, value)""",
+                           """CREATE UNIQUE INDEX IF NOT EXISTS values_map_key_idx ON values_map (table_name, column_name, key)"""]
+        elif type_ == settings.LOAN_PERFORMANCE_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS loan_performance
+            (
+                contract_id INTEGER NOT NULL,
+                payment_date TEXT,
+                amount_due REAL,
+                amount_paid REAL,
+                overdue_days INTEGER,
+                contract_date TEXT,
+                id_number INTEGER,
+                age INTEGER,
+                payment_id INTEGER
+            )""",
+                           """CREATE INDEX IF NOT EXISTS loan_performance_contract_date_idx ON loan_performance (contract_id, payment_date, payment_id)"""]
+        elif type_ == settings.WOE_SUMMARY_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS woe_iv_summary
+            (
+                feature TEXT NOT NULL PRIMARY KEY,
+                iv REAL,
+                bins INTEGER,
+                rank INTEGER
+            )"""]
+        elif type_ == settings.WOE_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS woe_tables
+            (
+                feature TEXT NOT NULL,
+                bin TEXT NOT NULL,
+                "default" INTEGER,
+                event REAL,
+                non_event REAL,
+                woe REAL,
+                iv REAL,
+                PRIMARY KEY (feature, bin)
+            )"""]
+        elif type_ == settings.RUNNER_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS runner_stages
+            (
+                stage TEXT NOT NULL PRIMARY KEY,
+                signature TEXT,
+                finished_at TEXT
+            )"""]
+        elif type_ == settings.TOTAL_SCORES_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS total_scores
+            (
+                id INTEGER NOT NULL PRIMARY KEY,
+                total_score REAL
+            )"""]
+        elif type_ == settings.DEFAULT_DATES_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS default_dates
+            (
+                contract_id INTEGER NOT NULL PRIMARY KEY,
+                payment_date TEXT
+            )"""]
+        elif type_ == settings.ROLL_RATES_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS roll_rates
+            (
+                month TEXT NOT NULL,
+                contract_type TEXT NOT NULL,
+                from_bucket TEXT NOT NULL,
+                to_bucket TEXT NOT NULL,
+                contracts INTEGER,
+                rate REAL,
+                PRIMARY KEY (month, contract_type, from_bucket, to_bucket)
+            )"""]
+        elif type_ == settings.CONTRACT_DEFAULTS_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS contract_defaults
+            (
+                contract_id INTEGER NOT NULL,
+                horizon INTEGER NOT NULL,
+                id_number INTEGER,
+                payment_date TEXT,
+                is_default INTEGER,
+                PRIMARY KEY (horizon, contract_id)
+            )"""]
+        elif type_ == settings.CLIENT_DEFAULTS_TABLE:
+            sql_queries = ["""CREATE TABLE IF NOT EXISTS client_defaults
+            (
+                horizon INTEGER NOT NULL,
+                id_number INTEGER NOT NULL,
+                is_default INTEGER,
+                PRIMARY KEY (horizon, id_number)
+            )"""]
         else:
-            sql_query = ""
-
-        self.execute_sql(raw_sql=sql_query, commit=True)
+            sql_queries = []
 
-    def join_tables(self, table1, table2, left_key, right_key):
-        sql_template = """CREATE TABLE IF NOT EXISTS {}_{} AS
-            SELECT * FROM {} as table1
-            JOIN {} as table2
-                ON table1.{} = table2.{}
-        """.format(table1, table2, table1, table2, left_key, right_key)
-        self.cursor.execute(sql_template)
-        self.connection.commit()
+        for sql_query in sql_queries:
+            self.execute_sql(raw_sql=sql_query)
+        if commit:
+            self.commit()
 
     def create_map(self, values_map, target_table, target_column):
-        create_sql = """CREATE TABLE IF NOT EXISTS values_map (key TEXT, value INTEGER, table_name TEXT, column_name TEXT)"""
-        self.cursor.execute(create_sql)
-        self.connection.commit()
+        self.create_table(type_=settings.VALUES_MAP_TABLE)
 
-        insert_temp = """INSERT INTO values_map VALUES (?, ?, ?, ?)"""
-        update_temp = """UPDATE {} SET {} = '{}' WHERE {} = '{}'"""
-        for pair in values_map.items():
-            self.cursor.execute(insert_temp, [pair[0], pair[1], target_table, target_column])
-            self.cursor.execute(update_temp.format(target_table, target_column, pair[1], target_column, pair[0]))
-        self.connection.commit()
+        # Re-running with the same map replaces its rows instead of adding duplicates
+        insert_temp = """INSERT OR REPLACE INTO values_map VALUES (?, ?, ?, ?)"""
+        # One pass over the table for the whole map; codes already in place are not keys, so they are left alone
+        update_temp = """UPDATE {0} SET {1} = (
+                SELECT value FROM values_map WHERE table_name = '{0}' AND column_name = '{1}' AND key = {0}.{1})
+            WHERE {1} IN (SELECT key FROM values_map WHERE table_name = '{0}' AND column_name = '{1}')"""
+        with self.transaction():
+            self.cursor.executemany(insert_temp, [[key, value, target_table, target_column]
+                                                  for key, value in values_map.items()])
+            self.cursor.execute(update_temp.format(target_table, target_column))
 
 
 def check_date(date_str):
     try:
-        datetime.strptime(date_str, "%m.%d.%Y")
+        datetime.strptime(date_str, settings.SOURCE_DATE_FORMAT)
         return True
     except ValueError:
         return False
@@ -107,104 +231,227 @@ def check_date(date_str):
         return False
 
 
-def create_profile(connection, data_path):
+PROFILE_LABELS = ["Identity Number", "Date of Birth", "Gender", "Employed By", "Issue Date", "Education",
+                  "Children", "Family", "Marital Status", "Position", "Housing", "Income", "Age of Car (if owned)",
+                  "House ownership", "Income Type"]
+CONTRACT_LABELS = ['Identity Number', 'Contract Number', 'Amount', 'Type', 'Term (month)', 'Annuity']
+DATE_LABELS = ("Date of Birth", "Issue Date")
+HOUSE_OWNERSHIP_VALUES = {'Y': 1, 'N': 0}
+
+
+def convert_date(value):
+    """
+    Convert a workbook date cell ("%m.%d.%Y" text or an Excel serial number)
+    to the ISO format the database stores
+    """
+    if check_date(value):
+        return datetime.strptime(value, settings.SOURCE_DATE_FORMAT).strftime(settings.DATE_FORMAT)
+    temp = datetime.fromordinal(int(value))
+    temp = datetime(day=temp.day, month=temp.month, year=temp.year + 1900)
+    return temp.strftime(settings.DATE_FORMAT)
+
+
+def read_sheet(file_name):
+    """
+    Read the first sheet of a workbook into a list of rows in one pass
+    """
+    book = xlrd.open_workbook(file_name, on_demand=True)
+    sheet = book.sheet_by_index(0)
+    rows = [sheet.row_values(i) for i in range(sheet.nrows)]
+    book.release_resources()
+    return rows
+
+
+def index_labels(rows, labels):
+    """
+    Map every label found in rows to the (row, column) of the cell below it.
+    The last occurrence of a label wins, as in the original cell-by-cell search.
+    """
+    labels = set(labels)
+    index = dict()
+    for i, row in enumerate(rows):
+        for j, value in enumerate(row):
+            if isinstance(value, str) and value in labels:
+                index[value] = (i + 1, j)
+    return index
+
+
+def cell_value(rows, position):
+    if position is None:
+        return None
+    i, j = position
+    try:
+        return rows[i][j]
+    except IndexError:
+        return None
+
+
+def parse_profile(file_name):
+    rows = read_sheet(file_name)
+    index = index_labels(rows, PROFILE_LABELS)
+    values = []
+    for label in PROFILE_LABELS:
+        value = cell_value(rows, index.get(label))
+        if label in DATE_LABELS:
+            value = convert_date(value) if label in index else None
+        elif label == "House ownership":
+            value = HOUSE_OWNERSHIP_VALUES.get(value)
+        values.append(value)
+    return values
+
+
+def parse_contract(file_name):
+    rows = read_sheet(file_name)
+    index = index_labels(rows, CONTRACT_LABELS)
+    values = [cell_value(rows, index.get(label)) for label in CONTRACT_LABELS]
+    values.append(convert_date(rows[1][5]))
+    return values
+
+
+def parse_files(parser, files, workers=1):
+    """
+    Yield parser(file) for every file, in the given order.
+    With workers > 1 the workbooks are parsed in a process pool; the order of
+    the results is the same as in the sequential path.
+    """
+    if workers <= 1:
+        for file in files:
+            yield parser(file)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for values in executor.map(parser, files, chunksize=settings.INGEST_CHUNK_SIZE):
+                yield values
+
+
+def ingest_files(connection, table_name, key_column, key_index, files, parser, insert_query, workers=1):
+    """
+    Parse the new or changed files and replace their rows in table_name; the rows of
+    the ingested files that are gone are deleted with their manifest entries.
+    Each batch of rows is committed together with its manifest entries, so an
+    interrupted run resumes from the first batch that was not committed.
+    """
+    changed = manifest.changed_files(connection, table_name, files)
+    removed = manifest.removed_files(connection, table_name, files)
+    if not changed and not removed:
+        return 0
+    version = manifest.current_version(connection) + 1
+    delete_query = """DELETE FROM %s WHERE %s = ?""" % (table_name, key_column)
+
+    if removed:
+        # A key still loaded from another workbook keeps its row
+        with connection.transaction():
+            manifest.forget_files(connection, removed)
+            connection.cursor.executemany(
+                """DELETE FROM %s WHERE %s = ? AND NOT EXISTS (SELECT 1 FROM %s WHERE table_name = ? AND row_key = ?)"""
+                % (table_name, key_column, settings.MANIFEST_TABLE),
+                [[entry.row_key, table_name, entry.row_key] for entry in removed])
+            manifest.record_replaced(connection, table_name, [entry.row_key for entry in removed], version)
+
+    def write_batch(batch):
+        # Drop the rows previously loaded from these files and any row with the same key
+        old_keys = [[entry.row_key] for entry, _ in batch if entry.row_key is not None]
+        new_keys = [[values[key_index]] for _, values in batch]
+        with connection.transaction():
+            connection.cursor.executemany(delete_query, old_keys + new_keys)
+            connection.cursor.executemany(insert_query, [values for _, values in batch])
+            manifest.record_files(connection, table_name, [(entry, values[key_index]) for entry, values in batch],
+                                  version)
+            manifest.record_replaced(connection, table_name, [entry.row_key for entry, values in batch
+                                                              if entry.row_key not in (None, values[key_index])], version)
+
+    batch = []
+    for entry, values in zip(changed, parse_files(parser, [entry.path for entry in changed], workers)):
+        batch.append((entry, values))
+        if len(batch) >= settings.INSERT_BATCH_SIZE:
+            write_batch(batch)
+            batch = []
+    if batch:
+        write_batch(batch)
+    return len(changed) + len(removed)
+
+
+def list_files(directory):
+    return [os.path.join(directory, file_name) for file_name in os.listdir(directory)]
+
+
+def create_profile(connection, data_path, workers=1):
     connection.create_table(type_=settings.PROFILE_TABLE)
     # open each workbook and parse the data
     profile_data = os.path.join(data_path, settings.PROFILE_TABLE)
     # create a insert query template
-    insert_query = """INSERT INTO profile VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
-    # create a main loop for file processing
-    for file_name in os.listdir(profile_data):
-        file = os.path.join(profile_data, file_name)
-        data = xlrd.open_workbook(file)
-        sheet = data.sheet_by_index(0)
-
-        labels = ["Identity Number", "Date of Birth", "Gender", "Employed By", "Issue Date", "Education",
-                  "Children", "Family", "Marital Status", "Position", "Housing", "Income", "Age of Car (if owned)",
-                  "House ownership", "Income Type"]
-        values = [None for _ in range(len(labels))]
-        row = sheet.nrows
-        column = sheet.ncols
-        for i in range(row):
-            for j in range(column):
-                for k in range(len(labels)):
-                    if sheet.cell(i, j).value == labels[k]:
-                        if labels[k] in ("Date of Birth", "Issue Date"):
-                            if check_date(sheet.cell(i + 1, j).value):
-                                values[k] = sheet.cell(i + 1, j).value
-                            else:
-                                temp = datetime.fromordinal(int(sheet.cell(i + 1, j).value))
-                                temp = datetime(day=temp.day, month=temp.month, year=temp.year + 1900)
-                                temp = temp.strftime("%m.%d.%Y")
-                                values[k] = temp
-                        elif labels[k] == 'House ownership':
-                            if sheet.cell(i + 1, j).value == 'Y':
-                                values[k] = 1
-                            elif sheet.cell(i + 1, j).value == 'N':
-                                values[k] = 0
-                            else:
-                                values[k] = None
-                        else:
-                            try:
-                                values[k] = sheet.cell(i + 1, j).value
-                            except IndexError:
-                                values[k] = None
-        connection.cursor.execute(insert_query, values)
-    connection.connection.commit()
-
-
-def create_contract(connection, data_path):
+    insert_query = """INSERT OR REPLACE INTO profile VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+    return ingest_files(connection, settings.PROFILE_TABLE, "id", 0, list_files(profile_data), parse_profile,
+                        insert_query, workers)
+
+
+def create_contract(connection, data_path, workers=1):
     connection.create_table(type_=settings.CONTRACT_TABLE)
     # open each workbook and parse the data
     profile_data = os.path.join(data_path, "contracts")
     # create a insert query template
-    insert_query = """INSERT INTO contract VALUES (?, ?, ?, ?, ?, ?, ?)"""
-    for file_name in os.listdir(profile_data):
-        file = os.path.join(profile_data, file_name)
-        data = xlrd.open_workbook(file)
-        sheet = data.sheet_by_index(0)
-        labels = ['Identity Number', 'Contract Number', 'Amount', 'Type', 'Term (month)', 'Annuity']
-        values = [None for _ in range(len(labels) + 1)]
-        row = sheet.nrows
-        column = sheet.ncols
-        for i in range(row):
-            for j in range(column):
-                for k in range(len(labels)):
-                    if sheet.cell(i, j).value == labels[k]:
-                        values[k] = sheet.cell(i + 1, j).value
-
-        if check_date(sheet.cell(1, 5).value):
-            values[-1] = sheet.cell(1, 5).value
-        else:
-            temp = datetime.fromordinal(int(sheet.cell(1, 5).value))
-            temp = datetime(day=temp.day, month=temp.month, year=temp.year + 1900)
-            temp = temp.strftime("%m.%d.%Y")
-            values[-1] = temp
-        connection.cursor.execute(insert_query, values)
-    connection.connection.commit()
+    insert_query = """INSERT OR REPLACE INTO contract VALUES (?, ?, ?, ?, ?, ?, ?)"""
+    return ingest_files(connection, settings.CONTRACT_TABLE, "contract_id", 1, list_files(profile_data),
+                        parse_contract, insert_query, workers)
+
+
+def convert_dates(values):
+    """
+    Vectorized convert_date for a chunk of date cells. Excel serial numbers are
+    converted to ISO dates with numpy, text cells go through convert_date.
+    """
+    is_number = np.array([isinstance(value, float) for value in values], dtype=bool)
+    result = np.array(values, dtype=object)
+    if is_number.any():
+        days = np.datetime64('0001-01-01', 'D') + (np.asarray(result[is_number], dtype=float).astype(np.int64) - 1)
+        months = days.astype('datetime64[M]')
+        years = months.astype('datetime64[Y]').astype(np.int64) + 1970 + 1900
+        day = (days - months).astype(np.int64) + 1
+        month = months.astype(np.int64) % 12 + 1
+        result[is_number] = np.char.add(np.char.add(np.char.mod("%04d-", years), np.char.mod("%02d-", month)),
+                                        np.char.mod("%02d", day))
+    # Text cells are rare, they go through the scalar path to keep its validation
+    for i in np.flatnonzero(~is_number):
+        result[i] = convert_date(result[i])
+    return result
+
+
+def read_payments(data_path, chunk_size=None):
+    """
+    Yield the rows of the payments workbook in chunks of converted
+    (contract_id, payment_date, amount_due, amount_paid) tuples
+    """
+    chunk_size = chunk_size or settings.PAYMENTS_CHUNK_SIZE
+    excel = xlrd.open_workbook(data_path, on_demand=True)
+    sheet = excel.sheet_by_index(0)
+    for start in range(1, sheet.nrows, chunk_size):
+        end = min(start + chunk_size, sheet.nrows)
+        contract_ids = np.asarray(sheet.col_values(0, start, end), dtype=float).astype(np.int64)
+        payment_dates = convert_dates(sheet.col_values(1, start, end))
+        amounts_due = np.asarray(sheet.col_values(2, start, end), dtype=float)
+        amounts_paid = np.asarray(sheet.col_values(3, start, end), dtype=float)
+        yield list(zip(contract_ids.tolist(), payment_dates.tolist(), amounts_due.tolist(), amounts_paid.tolist()))
+    excel.release_resources()
 
 
 def create_payments(connection, data_path):
     connection.create_table(type_=settings.PAYMENT_TABLE)
+    changed = manifest.changed_files(connection, settings.PAYMENT_TABLE, [data_path])
+    if not changed:
+        return 0
+    version = manifest.current_version(connection) + 1
+    start_time = time.perf_counter()
     insert_query = """INSERT INTO payment VALUES (?, ?, ?, ?)"""
-    excel = xlrd.open_workbook(data_path)
-    sheet = excel.sheet_by_index(0)
-    data = [sheet.col_values(0)[1::], sheet.col_values(1)[1::], sheet.col_values(2)[1::], sheet.col_values(3)[1::]]
-    for data in zip(sheet.col_values(0)[1::], sheet.col_values(1)[1::], sheet.col_values(2)[1::],
-                    sheet.col_values(3)[1::]):
-        values = [None, None, None, None]
-        if check_date(data[1]):
-            values[1] = data[1]
-        else:
-            temp = datetime.fromordinal(int(data[1]))
-            temp = datetime(day=temp.day, month=temp.month, year=temp.year + 1900)
-            temp = temp.strftime("%m.%d.%Y")
-            values[1] = temp
-        values[0] = int(data[0])
-        values[2] = float(data[2])
-        values[3] = float(data[3])
-        connection.cursor.execute(insert_query, values)
-    connection.connection.commit()
+    rows = 0
+    # The payments workbook is replaced as a whole, in the same transaction as its manifest entry
+    with connection.transaction():
+        connection.cursor.execute("DELETE FROM payment")
+        for chunk in read_payments(data_path):
+            connection.cursor.executemany(insert_query, chunk)
+            rows += len(chunk)
+        manifest.record_files(connection, settings.PAYMENT_TABLE, [(changed[0], None)], version)
+    elapsed = time.perf_counter() - start_time
+    print("Loaded %d payments in %.2fs (%d rows/sec)" % (rows, elapsed, rows / max(elapsed, 1e-9)))
+    return 1
 
 
 def check_input(string):
@@ -234,7 +481,7 @@ def generate_range(strat_date, end_date, horizon):
 def write_dataframe(dataframe, connection, sql_template):
     for _, row in dataframe.iterrows():
         connection.cursor.execute(sql_template, [i for i in row])
-    connection.connection.commit()
+    connection.commit()
 
 
 def resample_frame(df, days, key):
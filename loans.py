@@ -0,0 +1,436 @@
+"""
+Loan performance calculations shared by the analytics tasks
+"""
+import numpy as np
+import pandas as pd
+
+import manifest
+import settings
+from materialize import built_version, record_build
+from utils import compact_frame, convert_data_from_categorical
+
+
+def overdue_days(payments_df):
+    """
+    Overdue days on every payment date (-1 - no overdue), aligned with payments_df.index.
+
+    A payment smaller than due adds 30 days (the first missed one starts at 0),
+    a bigger one pays off round(paid / due) - 1 months, an exact one clears the
+    overdue. The first payment of a contract is never overdue.
+    """
+    if payments_df.empty:
+        return pd.Series(np.empty(0, dtype=np.int64), index=payments_df.index, name="overdue_days")
+    contract_ids = payments_df.contract_id.values
+    # Stable sort, so payments on the same date keep their order
+    order = np.lexsort((payments_df.payment_date.values, contract_ids))
+    contract_ids = contract_ids[order]
+    due = payments_df.amount_due.values[order].astype(float)
+    paid = payments_df.amount_paid.values[order].astype(float)
+
+    # In months of overdue (u = -1 - no overdue) a payment is u = max(u + step, -1)
+    underpaid = paid < due
+    overpaid = paid > due
+    with np.errstate(divide="ignore", invalid="ignore"):
+        steps = np.where(underpaid, 1.0, 1.0 - np.round(paid / due))
+    # Paying more months than there are rows clears any overdue, and keeps the sums finite
+    steps = np.clip(steps, -len(steps) - 1, 1.0)
+
+    # Exact (or missing) payments and the first payments reset to -1 and start a new segment
+    reset = ~(underpaid | overpaid)
+    reset[0] = True
+    reset[1:] |= contract_ids[1:] != contract_ids[:-1]
+    steps[reset] = 0.0
+
+    # Within a segment the clamped walk is the running sum minus its running minimum
+    totals = np.cumsum(steps)
+    segments = np.cumsum(reset) - 1
+    totals -= totals[reset][segments]
+    lowest = pd.Series(totals).groupby(segments).cummin().values
+    months = totals - lowest - 1
+
+    result = np.empty(len(order), dtype=np.int64)
+    result[order] = np.where(months < 0, -1, months * 30).astype(np.int64)
+    return pd.Series(result, index=payments_df.index, name="overdue_days")
+
+
+def default_dates(payments_df):
+    """
+    Last date a contract reached 90 overdue days (it may pay off and return to 60),
+    payments_df needs the overdue_days column
+    """
+    defaults = payments_df[payments_df.overdue_days == 90]
+    return defaults.groupby(["contract_id"], as_index=False).agg({"payment_date": "max"})
+
+
+def first_payments(payments_df):
+    """
+    First payment of every contract, ordered by contract_id
+    """
+    ordered = payments_df.sort_values(["contract_id", "payment_date"], kind="mergesort")
+    return ordered.drop_duplicates(["contract_id"])[["contract_id", "payment_date", "amount_due", "amount_paid"]]
+
+
+def contract_age(payment_dates, contract_dates):
+    """
+    Age of the contract in months on each payment date (calendar months, the days are ignored)
+    """
+    return (payment_dates.dt.year - contract_dates.dt.year) * 12 + (payment_dates.dt.month - contract_dates.dt.month)
+
+
+def add_contract_columns(payments_df, contracts_df):
+    """
+    Add contract_date, id_number (the borrower) and age to the payments.
+    contracts_df is the contract table indexed by contract_id.
+    """
+    contracts = contracts_df.reindex(payments_df.contract_id.values)
+    payments_df["contract_date"] = contracts.contract_date.values
+    payments_df["id_number"] = contracts.id.values
+    payments_df["age"] = contract_age(payments_df.payment_date, payments_df.contract_date)
+    return payments_df
+
+
+def default_matrix(payments_df, default_dates, horizons):
+    """
+    Default flag of every contract on every horizon, in one pass over the payments.
+    A contract has defaulted on a horizon when its payment at that age (in months)
+    is on or after its last 90-day date. payments_df needs the add_contract_columns columns.
+    """
+    rows = payments_df[payments_df.age.isin(list(horizons))]
+    # As in the single horizon report, the first payment of the contract at that age in the
+    # frame decides (horizon_payments gives them in the order of the payment source)
+    rows = rows.drop_duplicates(["contract_id", "age"])
+    last_default = rows.contract_id.map(default_dates.set_index("contract_id").payment_date)
+    matrix = pd.DataFrame({"contract_id": rows.contract_id.values,
+                           "horizon": rows.age.values,
+                           "id_number": rows.id_number.values,
+                           "payment_date": rows.payment_date.values,
+                           "default": (rows.payment_date >= last_default).values})
+    return matrix.sort_values(["horizon", "contract_id"]).reset_index(drop=True)
+
+
+def client_defaults(matrix):
+    """
+    Per-client rollup of default_matrix: a client has defaulted if any of their contracts has
+    """
+    return matrix.groupby(["horizon", "id_number"], as_index=False).agg({"default": "max"})
+
+
+def horizon_defaults(rollup, horizon):
+    """
+    Clients defaulted on one horizon, in the layout of the defaults on horizon table
+    """
+    rows = rollup[rollup.horizon == horizon]
+    return pd.DataFrame({"id_number": rows.id_number.values,
+                         "age": rows.horizon.values,
+                         "Default?": rows.default.values.astype(bool)})
+
+
+def store_defaults(connection, matrix, rollup):
+    """
+    Replace the stored default matrix and its per-client rollup
+    """
+    with connection.transaction():
+        connection.create_table(type_=settings.CONTRACT_DEFAULTS_TABLE)
+        connection.create_table(type_=settings.CLIENT_DEFAULTS_TABLE)
+        connection.execute_sql("DELETE FROM %s" % settings.CONTRACT_DEFAULTS_TABLE)
+        connection.execute_sql("DELETE FROM %s" % settings.CLIENT_DEFAULTS_TABLE)
+        connection.cursor.executemany("INSERT INTO %s VALUES (?, ?, ?, ?, ?)" % settings.CONTRACT_DEFAULTS_TABLE, zip(
+            matrix.contract_id.tolist(), matrix.horizon.tolist(), matrix.id_number.tolist(),
+            iso_dates(matrix.payment_date), matrix["default"].astype(int).tolist()))
+        connection.cursor.executemany("INSERT INTO %s VALUES (?, ?, ?)" % settings.CLIENT_DEFAULTS_TABLE, zip(
+            rollup.horizon.tolist(), rollup.id_number.tolist(), rollup["default"].astype(int).tolist()))
+
+
+def load_defaults(connection, horizon):
+    """
+    Stored per-client defaults on one horizon, see horizon_defaults
+    """
+    rollup = pd.read_sql_query("SELECT horizon, id_number, is_default AS \"default\" FROM %s WHERE horizon = ? ORDER BY id_number"
+                               % settings.CLIENT_DEFAULTS_TABLE, connection.connection, params=[horizon])
+    return horizon_defaults(rollup, horizon)
+
+
+def iso_dates(dates):
+    """
+    Datetime column as a list of ISO date strings (None for NaT), for storing in SQLite
+    """
+    values = dates.values.astype("datetime64[D]")
+    return np.where(np.isnat(values), None, np.datetime_as_string(values)).tolist()
+
+
+# payment_id is the rowid of the payment: the order of the payments in the source, whichever
+# way the table was built. Payments on the same date and "the first payment at an age" follow it.
+PERFORMANCE_COLUMNS = ["contract_id", "payment_date", "amount_due", "amount_paid",
+                       "overdue_days", "contract_date", "id_number", "age", "payment_id"]
+
+# Downcast by the readers: overdue_days and age fit in int16, the ids in int32
+PERFORMANCE_INTEGERS = ["contract_id", "overdue_days", "id_number", "age", "payment_id"]
+
+
+def compute_performance(connection):
+    """
+    Payments with overdue_days and the add_contract_columns columns, straight from the source tables
+    """
+    payments_df = pd.read_sql_query("SELECT *, rowid AS payment_id FROM %s ORDER BY rowid" % settings.PAYMENT_TABLE,
+                                    connection.connection, parse_dates=["payment_date"])
+    contracts_df = pd.read_sql_query("SELECT * FROM %s" % settings.CONTRACT_TABLE, connection.connection,
+                                     index_col="contract_id", parse_dates=["contract_date"])
+    payments_df["overdue_days"] = overdue_days(payments_df)
+    add_contract_columns(payments_df, contracts_df)
+    return payments_df[PERFORMANCE_COLUMNS]
+
+
+def insert_performance(connection, performance_df):
+    columns = [iso_dates(performance_df[column]) if column.endswith("_date") else performance_df[column].tolist()
+               for column in PERFORMANCE_COLUMNS]
+    connection.cursor.executemany("INSERT INTO %s (%s) VALUES (%s)" % (settings.LOAN_PERFORMANCE_TABLE,
+                                                                       ", ".join(PERFORMANCE_COLUMNS),
+                                                                       ", ".join("?" * len(PERFORMANCE_COLUMNS))),
+                                  zip(*columns))
+
+
+def insert_default_dates(connection, dates):
+    connection.cursor.executemany("INSERT INTO %s VALUES (?, ?)" % settings.DEFAULT_DATES_TABLE,
+                                  zip(dates.contract_id.tolist(), iso_dates(dates.payment_date)))
+
+
+def clear_performance(connection):
+    for type_ in (settings.LOAN_PERFORMANCE_TABLE, settings.DEFAULT_DATES_TABLE):
+        connection.create_table(type_=type_)
+        connection.execute_sql("DELETE FROM %s" % type_)
+
+
+def store_performance(connection, performance_df, version):
+    with connection.transaction():
+        clear_performance(connection)
+        insert_performance(connection, performance_df)
+        insert_default_dates(connection, default_dates(performance_df))
+        record_build(connection, settings.LOAN_PERFORMANCE_TABLE, "full", version)
+        record_build(connection, settings.DEFAULT_DATES_TABLE, "full", version)
+
+
+def contract_blocks(cursor, columns, chunk_size):
+    """
+    Yield the rows of an executed cursor, ordered by contract_id (the first column), as frames
+    of about chunk_size rows. A contract is never split between frames: the rows of the last
+    contract of a chunk are carried over to the next one.
+    """
+    carried = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        rows = carried + rows
+        split = len(rows)
+        while split and rows[split - 1][0] == rows[-1][0]:
+            split -= 1
+        carried = rows[split:]
+        if split:
+            yield block_frame(rows[:split], columns)
+    if carried:
+        yield block_frame(carried, columns)
+
+
+def block_frame(rows, columns):
+    block = pd.DataFrame.from_records(rows, columns=columns)
+    for column in columns:
+        if column.endswith("_date"):
+            block[column] = pd.to_datetime(block[column])
+    return block
+
+
+STREAM_COLUMNS = ["contract_id", "payment_date", "amount_due", "amount_paid", "contract_date", "id_number", "payment_id"]
+
+
+def payment_blocks(connection, chunk_size=settings.STREAM_CHUNK_SIZE):
+    """
+    Payments with their contract_date, id_number and payment_id ordered by contract_id,
+    payment_date and payment_id, in contract_blocks of about chunk_size rows
+    """
+    # A cursor of its own, so the caller can write with connection.cursor meanwhile
+    cursor = connection.connection.cursor()
+    cursor.execute("""SELECT p.contract_id, p.payment_date, p.amount_due, p.amount_paid, c.contract_date, c.id, p.rowid
+                      FROM %s p LEFT JOIN %s c ON c.contract_id = p.contract_id
+                      ORDER BY p.contract_id, p.payment_date, p.rowid""" % (settings.PAYMENT_TABLE, settings.CONTRACT_TABLE))
+    return contract_blocks(cursor, STREAM_COLUMNS, chunk_size)
+
+
+def stream_performance(connection, chunk_size=settings.STREAM_CHUNK_SIZE):
+    """
+    Build the loan_performance and default_dates tables contract by contract, holding about
+    chunk_size payments in memory instead of the whole table. The rows are stored ordered by
+    contract_id, payment_date and payment_id. Returns the number of payments.
+    """
+    version = manifest.current_version(connection)
+    rows = 0
+    with connection.transaction():
+        clear_performance(connection)
+        for block in payment_blocks(connection, chunk_size):
+            block["overdue_days"] = overdue_days(block)
+            block["age"] = contract_age(block.payment_date, block.contract_date)
+            insert_performance(connection, block)
+            insert_default_dates(connection, default_dates(block))
+            rows += len(block)
+        record_build(connection, settings.LOAN_PERFORMANCE_TABLE, "stream", version)
+        record_build(connection, settings.DEFAULT_DATES_TABLE, "stream", version)
+    return rows
+
+
+def refresh_performance(connection):
+    """
+    Bring the loan_performance (payments with overdue_days, contract_date, id_number and age)
+    and default_dates tables up to date. They are computed once per ingest version (see
+    manifest.py), in memory below settings.STREAM_PAYMENT_ROWS payments and by
+    stream_performance from there on. The tables are read back in parts by performance_blocks,
+    horizon_payments, load_default_dates and load_first_payments. Returns the ingest version.
+    """
+    version = manifest.current_version(connection)
+    if (built_version(connection, settings.LOAN_PERFORMANCE_TABLE) != version or
+            built_version(connection, settings.DEFAULT_DATES_TABLE) != version):
+        connection.cursor.execute("SELECT COUNT(*) FROM %s" % settings.PAYMENT_TABLE)
+        if connection.cursor.fetchone()[0] < settings.STREAM_PAYMENT_ROWS:
+            store_performance(connection, compute_performance(connection), version)
+        else:
+            stream_performance(connection)
+    return version
+
+
+def performance_blocks(connection, chunk_size=settings.STREAM_CHUNK_SIZE):
+    """
+    loan_performance ordered by contract_id, payment_date and payment_id, in contract_blocks
+    of about chunk_size rows
+    """
+    cursor = connection.connection.cursor()
+    cursor.execute("SELECT %s FROM %s ORDER BY contract_id, payment_date, payment_id"
+                   % (", ".join(PERFORMANCE_COLUMNS), settings.LOAN_PERFORMANCE_TABLE))
+    for block in contract_blocks(cursor, PERFORMANCE_COLUMNS, chunk_size):
+        yield compact_frame(block, integers=PERFORMANCE_INTEGERS)
+
+
+def horizon_payments(connection, horizons):
+    """
+    The loan_performance rows at the ages of the horizons in the order of the payment source
+    (payment_id), which is all default_matrix needs
+    """
+    performance_df = pd.read_sql_query("SELECT * FROM %s WHERE age IN (%s) ORDER BY payment_id"
+                                       % (settings.LOAN_PERFORMANCE_TABLE, ", ".join("?" * len(horizons))),
+                                       connection.connection, params=[int(horizon) for horizon in horizons],
+                                       parse_dates=["payment_date", "contract_date"])
+    return compact_frame(performance_df, integers=PERFORMANCE_INTEGERS)
+
+
+def load_default_dates(connection):
+    """
+    default_dates of the whole loan_performance table, from the default_dates table
+    """
+    dates = pd.read_sql_query("SELECT contract_id, payment_date FROM %s ORDER BY contract_id"
+                              % settings.DEFAULT_DATES_TABLE, connection.connection, parse_dates=["payment_date"])
+    return compact_frame(dates, integers=["contract_id"])
+
+
+def load_first_payments(connection, chunk_size=settings.STREAM_CHUNK_SIZE):
+    """
+    first_payments of the whole loan_performance table, one performance block at a time
+    """
+    blocks = [first_payments(block) for block in performance_blocks(connection, chunk_size)]
+    if not blocks:
+        return pd.DataFrame(columns=["contract_id", "payment_date", "amount_due", "amount_paid"])
+    return pd.concat(blocks, ignore_index=True)
+
+
+BUCKETS = ["current", "0", "30", "60", "90+"]
+
+ROLL_RATE_KEYS = ["month", "contract_type", "from_bucket", "to_bucket"]
+
+
+def overdue_buckets(overdue_days):
+    """
+    Index in BUCKETS of every overdue_days value (-1 - current)
+    """
+    return np.searchsorted([0, 30, 60, 90], overdue_days, side="right")
+
+
+def contract_types(connection):
+    """
+    Decoded contract.type by contract_id
+    """
+    contracts_df = pd.read_sql_query("SELECT contract_id, type FROM %s" % settings.CONTRACT_TABLE,
+                                     connection.connection, index_col="contract_id")
+    types = convert_data_from_categorical(contracts_df.type.values, "type", connection)
+    return pd.Series(np.asarray(types, dtype=object), index=contracts_df.index).fillna("Unknown")
+
+
+def transition_counts(performance_df, types):
+    """
+    Number of moves between the overdue buckets (indexes in BUCKETS) of consecutive payments
+    of a contract, by month of the later payment, contract type (types - by contract_id) and
+    the two buckets. Counts of frames with different contracts add up.
+    """
+    order = np.lexsort((performance_df.payment_date.values, performance_df.contract_id.values))
+    contract_ids = performance_df.contract_id.values[order]
+    buckets = overdue_buckets(performance_df.overdue_days.values[order])
+    months = performance_df.payment_date.values[order].astype("datetime64[M]")
+
+    same = contract_ids[1:] == contract_ids[:-1]
+    transitions = pd.DataFrame({"month": months[1:][same],
+                                "contract_type": types.reindex(contract_ids[1:][same]).fillna("Unknown").values,
+                                "from_bucket": buckets[:-1][same],
+                                "to_bucket": buckets[1:][same]})
+    return transitions.groupby(ROLL_RATE_KEYS).size().rename("contracts").reset_index()
+
+
+def rates_from_counts(counts):
+    """
+    Sum up transition_counts and add the rate: the share of the contracts in from_bucket that went to to_bucket
+    """
+    rates = counts.groupby(ROLL_RATE_KEYS).contracts.sum().reset_index()
+    rates["rate"] = rates.contracts / rates.groupby(["month", "contract_type", "from_bucket"]).contracts.transform("sum")
+    rates["month"] = np.datetime_as_string(rates.month.values.astype("datetime64[M]"))
+    rates["from_bucket"] = np.array(BUCKETS, dtype=object)[rates.from_bucket.values]
+    rates["to_bucket"] = np.array(BUCKETS, dtype=object)[rates.to_bucket.values]
+    return rates
+
+
+def roll_rates(performance_df, types):
+    """
+    Transitions between the overdue buckets of consecutive payments of a contract, counted
+    by month of the later payment, contract type and the two buckets, with their rates
+    """
+    return rates_from_counts(transition_counts(performance_df, types))
+
+
+def performance_roll_rates(connection, types, chunk_size=settings.STREAM_CHUNK_SIZE):
+    """
+    roll_rates of the whole loan_performance table, counted one performance block at a time
+    """
+    counts = [transition_counts(block, types) for block in performance_blocks(connection, chunk_size)]
+    if not counts:
+        counts = [pd.DataFrame({"month": np.empty(0, dtype="datetime64[M]"), "contract_type": [],
+                                "from_bucket": np.empty(0, dtype=np.int64), "to_bucket": np.empty(0, dtype=np.int64),
+                                "contracts": np.empty(0, dtype=np.int64)})]
+    return rates_from_counts(pd.concat(counts, ignore_index=True))
+
+
+def roll_rate_matrix(rates, month=None, contract_type=None, values="rate"):
+    """
+    BUCKETS x BUCKETS matrix (from - rows) of the whole portfolio or one month / contract type,
+    values="contracts" gives the counts
+    """
+    if month is not None:
+        rates = rates[rates.month == month]
+    if contract_type is not None:
+        rates = rates[rates.contract_type == contract_type]
+    counts = rates.pivot_table(index="from_bucket", columns="to_bucket", values="contracts", aggfunc="sum")
+    counts = counts.reindex(index=BUCKETS, columns=BUCKETS).fillna(0).astype(np.int64)
+    if values == "contracts":
+        return counts
+    return counts.div(counts.sum(axis=1).replace(0, np.nan), axis=0)
+
+
+def store_roll_rates(connection, rates):
+    with connection.transaction():
+        connection.create_table(type_=settings.ROLL_RATES_TABLE)
+        connection.execute_sql("DELETE FROM %s" % settings.ROLL_RATES_TABLE)
+        connection.cursor.executemany("INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?)" % settings.ROLL_RATES_TABLE, zip(
+            rates.month.tolist(), rates.contract_type.tolist(), rates.from_bucket.tolist(), rates.to_bucket.tolist(),
+            rates.contracts.tolist(), rates.rate.tolist()))
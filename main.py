@@ -1,32 +1,40 @@
-import task1
-import task2
-import task3
-import task4
+import importlib
 
+import settings
+
+# Task modules (and pandas, matplotlib, sklearn behind them) are imported only when chosen
 task_choices = {
-    1: ("1. Task 1", task1.main),
-    2: ("2. Task 2", task2.main),
-    3: ("3. Task 3", task3.main),
-    4: ("4. Task 4", task4.main),
-    0: ("0. Exit", exit),
+    1: ("1. Task 1", "task1"),
+    2: ("2. Task 2", "task2"),
+    3: ("3. Task 3", "task3"),
+    4: ("4. Task 4", "task4"),
+    0: ("0. Exit", None),
 }
 
-print("Hello!")
 
+def main():
+    settings.init()
+    print("Hello!")
+
+    while True:
+
+        for choice in task_choices.values():
+            print(choice[0])
 
-while True:
+        task_choice = input("Please choose task: ")
+        while task_choice not in task_choices.keys():
+            try:
+                task_choice = int(task_choice)
+            except ValueError:
+                print("You entered wrong value! Please try again...")
+                task_choice = input("Please choose task: ")
 
-    for choice in task_choices.values():
-        print(choice[0])
+        choice_t = task_choices[task_choice]
+        print("You've chosen %s" % choice_t[0])
+        if choice_t[1] is None:
+            exit()
+        importlib.import_module(choice_t[1]).main()
 
-    task_choice = input("Please choose task: ")
-    while task_choice not in task_choices.keys():
-        try:
-            task_choice = int(task_choice)
-        except ValueError:
-            print("You entered wrong value! Please try again...")
-            task_choice = input("Please choose task: ")
 
-    choice_t = task_choices[task_choice]
-    print("You've chosen %s" % choice_t[0])
-    choice_t[1]()
+if __name__ == '__main__':  # workers of the parallel ingest re-import this module
+    main()
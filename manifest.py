@@ -0,0 +1,121 @@
+import hashlib
+import os
+from collections import namedtuple
+
+import settings
+
+SourceFile = namedtuple("SourceFile", ["path", "size", "mtime", "content_hash", "row_key"])
+
+
+def create_manifest(connection):
+    connection.execute_sql("""CREATE TABLE IF NOT EXISTS %s
+    (
+        path TEXT PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        row_key INTEGER,
+        size INTEGER,
+        mtime REAL,
+        content_hash TEXT,
+        ingest_version INTEGER
+    )""" % settings.MANIFEST_TABLE)
+    # Keys whose rows an ingest removed without loading them again, for the incremental joins
+    connection.execute_sql("""CREATE TABLE IF NOT EXISTS %s
+    (
+        table_name TEXT NOT NULL,
+        row_key INTEGER NOT NULL,
+        ingest_version INTEGER
+    )""" % settings.REPLACED_KEYS_TABLE)
+    connection.execute_sql("CREATE INDEX IF NOT EXISTS %s_version_idx ON %s (ingest_version)"
+                           % (settings.REPLACED_KEYS_TABLE, settings.REPLACED_KEYS_TABLE), commit=True)
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_path(path):
+    # Paths are stored relative to DATA_DIR so the project folder can be moved
+    return os.path.relpath(path, settings.DATA_DIR)
+
+
+def current_version(connection):
+    # An ingest that only removed files leaves its version in replaced_keys alone
+    create_manifest(connection)
+    connection.cursor.execute("""SELECT MAX((SELECT COALESCE(MAX(ingest_version), 0) FROM %s),
+                                            (SELECT COALESCE(MAX(ingest_version), 0) FROM %s))"""
+                              % (settings.MANIFEST_TABLE, settings.REPLACED_KEYS_TABLE))
+    return connection.cursor.fetchone()[0]
+
+
+def changed_files(connection, table_name, files):
+    """
+    Return a SourceFile for every file that is new or whose content changed since it was ingested.
+    Files are hashed only when their size or mtime differ from the manifest.
+    """
+    create_manifest(connection)
+    connection.cursor.execute("SELECT path, size, mtime, content_hash, row_key FROM %s WHERE table_name = ?"
+                              % settings.MANIFEST_TABLE, [table_name])
+    known = {row[0]: SourceFile(*row) for row in connection.cursor.fetchall()}
+
+    changed = []
+    touched = []
+    for file in files:
+        path = source_path(file)
+        stat = os.stat(file)
+        entry = known.get(path)
+        if entry and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+            continue
+        content_hash = file_hash(file)
+        if entry and entry.content_hash == content_hash:
+            touched.append([stat.st_mtime, path])
+            continue
+        changed.append(SourceFile(file, stat.st_size, stat.st_mtime, content_hash, entry.row_key if entry else None))
+
+    if touched:
+        connection.cursor.executemany("UPDATE %s SET mtime = ? WHERE path = ?" % settings.MANIFEST_TABLE, touched)
+        connection.commit()
+    return changed
+
+
+def removed_files(connection, table_name, files):
+    """
+    Return a SourceFile (as stored in the manifest) for every ingested file of table_name
+    that is not among files any more
+    """
+    create_manifest(connection)
+    present = set(source_path(file) for file in files)
+    connection.cursor.execute("SELECT path, size, mtime, content_hash, row_key FROM %s WHERE table_name = ?"
+                              % settings.MANIFEST_TABLE, [table_name])
+    return [SourceFile(*row) for row in connection.cursor.fetchall() if row[0] not in present]
+
+
+def forget_files(connection, entries):
+    """
+    Drop the manifest entries of the removed files. The caller commits.
+    """
+    connection.cursor.executemany("DELETE FROM %s WHERE path = ?" % settings.MANIFEST_TABLE,
+                                  [[entry.path] for entry in entries])
+
+
+def record_files(connection, table_name, entries, version):
+    """
+    Store (SourceFile, row_key) pairs in the manifest. The caller commits, so the
+    manifest is updated in the same transaction as the rows of the files.
+    """
+    insert_query = """INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?, ?, ?)""" % settings.MANIFEST_TABLE
+    connection.cursor.executemany(insert_query, [
+        [source_path(entry.path), table_name, row_key, entry.size, entry.mtime, entry.content_hash, version]
+        for entry, row_key in entries
+    ])
+
+
+def record_replaced(connection, table_name, keys, version):
+    """
+    Store the row keys an ingest removed (a workbook now has another key or was deleted). The caller commits.
+    """
+    connection.cursor.executemany("INSERT INTO %s VALUES (?, ?, ?)" % settings.REPLACED_KEYS_TABLE,
+                                  [[table_name, key, version] for key in keys])
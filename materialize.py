@@ -0,0 +1,212 @@
+"""
+Materialized joins of the ingest tables. Each join has explicit, typed
+columns and indexes; it is rebuilt in full or refreshed only for the
+contracts touched by the ingests of its own source tables that happened
+since it was built.
+"""
+from datetime import datetime
+
+import manifest
+import settings
+
+PROFILE_COLUMNS = [
+    ("id", "INTEGER NOT NULL"),
+    ("birth", "TEXT"),
+    ("gender", "TEXT"),
+    ("employed_by", "TEXT"),
+    ("issue_date", "TEXT"),
+    ("education", "TEXT"),
+    ("children", "INTEGER"),
+    ("family", "INTEGER"),
+    ("marital_status", "TEXT"),
+    ("position", "TEXT"),
+    ("housing", "TEXT"),
+    ("income", "INTEGER"),
+    ("age_of_car", "INTEGER"),
+    ("house_ownership", "INTEGER"),
+    ("income_type", "TEXT"),
+]
+CONTRACT_COLUMNS = [
+    ("contract_id", "INTEGER NOT NULL"),
+    ("amount", "INTEGER"),
+    ("type", "TEXT"),
+    ("month_term", "INTEGER"),
+    ("annuity", "INTEGER"),
+    ("contract_date", "TEXT"),
+]
+PAYMENT_COLUMNS = [
+    ("payment_date", "TEXT"),
+    ("amount_due", "REAL"),
+    ("amount_paid", "REAL"),
+]
+
+MATERIALIZED_JOINS = [
+    {
+        "name": settings.PROFILE_CONTRACT_TABLE,
+        "columns": [("profile." + name, name, type_) for name, type_ in PROFILE_COLUMNS] +
+                   [("contract." + name, name, type_) for name, type_ in CONTRACT_COLUMNS],
+        "primary_key": "contract_id",
+        "from": """contract JOIN profile ON profile.id = contract.id""",
+        "sources": [settings.CONTRACT_TABLE, settings.PROFILE_TABLE],
+        "indexes": ["id"],
+    },
+    {
+        "name": settings.PROFILE_CONTRACT_PAYMENT_TABLE,
+        "columns": [("profile." + name, name, type_) for name, type_ in PROFILE_COLUMNS] +
+                   [("contract." + name, name, type_) for name, type_ in CONTRACT_COLUMNS] +
+                   [("payment." + name, name, type_) for name, type_ in PAYMENT_COLUMNS],
+        "primary_key": None,
+        "from": """payment JOIN contract ON contract.contract_id = payment.contract_id
+            JOIN profile ON profile.id = contract.id""",
+        "sources": [settings.PAYMENT_TABLE, settings.CONTRACT_TABLE, settings.PROFILE_TABLE],
+        "indexes": ["contract_id, payment_date", "id"],
+    },
+]
+
+
+def create_registry(connection):
+    connection.execute_sql("""CREATE TABLE IF NOT EXISTS %s
+    (
+        name TEXT PRIMARY KEY,
+        built_at TEXT,
+        mode TEXT,
+        ingest_version INTEGER,
+        rows INTEGER
+    )""" % settings.MATERIALIZED_TABLE)
+
+
+def create_join_table(connection, join):
+    columns = ["%s %s%s" % (name, type_, " PRIMARY KEY" if name == join["primary_key"] else "")
+               for _, name, type_ in join["columns"]]
+    connection.execute_sql("CREATE TABLE IF NOT EXISTS %s (%s)" % (join["name"], ", ".join(columns)))
+    for index in join["indexes"]:
+        connection.execute_sql("CREATE INDEX IF NOT EXISTS %s_%s_idx ON %s (%s)"
+                               % (join["name"], index.replace(", ", "_"), join["name"], index))
+
+
+def insert_sql(join, where=""):
+    return "INSERT INTO %s (%s) SELECT %s FROM %s %s" % (
+        join["name"],
+        ", ".join(name for _, name, _ in join["columns"]),
+        ", ".join(source for source, _, _ in join["columns"]),
+        join["from"],
+        where,
+    )
+
+
+def record_build(connection, name, mode, version, rows=None):
+    create_registry(connection)
+    if rows is None:
+        connection.cursor.execute("SELECT COUNT(*) FROM %s" % name)
+        rows = connection.cursor.fetchone()[0]
+    connection.cursor.execute("INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?)" % settings.MATERIALIZED_TABLE,
+                              [name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), mode, version, rows])
+
+
+def built_version(connection, name):
+    """
+    Ingest version the table was last built at, None if it was never built
+    """
+    create_registry(connection)
+    connection.cursor.execute("SELECT ingest_version FROM %s WHERE name = ?" % settings.MATERIALIZED_TABLE, [name])
+    row = connection.cursor.fetchone()
+    return row[0] if row else None
+
+
+def built_rows(connection, name):
+    """
+    Rows of the table at its last build, None if it was never built
+    """
+    create_registry(connection)
+    connection.cursor.execute("SELECT rows FROM %s WHERE name = ?" % settings.MATERIALIZED_TABLE, [name])
+    row = connection.cursor.fetchone()
+    return row[0] if row else None
+
+
+def built_on(connection, name):
+    """
+    Date (YYYY-MM-DD) the table was last built on, None if it was never built
+    """
+    create_registry(connection)
+    connection.cursor.execute("SELECT substr(built_at, 1, 10) FROM %s WHERE name = ?" % settings.MATERIALIZED_TABLE,
+                              [name])
+    row = connection.cursor.fetchone()
+    return row[0] if row else None
+
+
+def touched_contracts(connection, since_version, sources):
+    """
+    Fill the touched_contracts and touched_profiles temp tables with the keys whose rows may
+    have changed in the ingests of the sources tables after since_version: the keys loaded,
+    the keys removed (see manifest.record_replaced) and the contracts of the touched profiles.
+    Returns the number of touched contracts and profiles, None when the payments workbook
+    changed and every contract is affected.
+    """
+    connection.cursor.execute("""SELECT table_name, row_key FROM %s WHERE ingest_version > ? AND table_name IN (%s)
+                                 UNION SELECT table_name, row_key FROM %s WHERE ingest_version > ? AND table_name IN (%s)"""
+                              % (settings.MANIFEST_TABLE, ", ".join("?" * len(sources)),
+                                 settings.REPLACED_KEYS_TABLE, ", ".join("?" * len(sources))),
+                              [since_version] + sources + [since_version] + sources)
+    contracts = []
+    profiles = []
+    for table_name, row_key in connection.cursor.fetchall():
+        if table_name == settings.PAYMENT_TABLE:
+            return None
+        elif table_name == settings.CONTRACT_TABLE:
+            contracts.append([row_key])
+        elif table_name == settings.PROFILE_TABLE:
+            profiles.append([row_key])
+    for table_name, column, keys in (("touched_contracts", "contract_id", contracts), ("touched_profiles", "id", profiles)):
+        connection.execute_sql("CREATE TEMP TABLE IF NOT EXISTS %s (%s INTEGER PRIMARY KEY)" % (table_name, column))
+        connection.execute_sql("DELETE FROM %s" % table_name)
+        connection.cursor.executemany("INSERT OR IGNORE INTO %s VALUES (?)" % table_name, keys)
+    connection.execute_sql("""INSERT OR IGNORE INTO touched_contracts
+                              SELECT contract_id FROM contract WHERE id IN (SELECT id FROM touched_profiles)""")
+    return len(contracts) + len(profiles)
+
+
+def rebuild(connection, join, version):
+    with connection.transaction():
+        connection.execute_sql("DROP TABLE IF EXISTS %s" % join["name"])
+        create_join_table(connection, join)
+        connection.cursor.execute(insert_sql(join))
+        record_build(connection, join["name"], "full", version, connection.cursor.rowcount)
+
+
+def refresh(connection, join, version):
+    """
+    Replace the rows of the touched contracts and drop the ones of the touched profiles
+    (a contract moved to another profile, a profile removed or loaded with another id);
+    both deletes go through the indexes, so the cost follows the number of touched keys
+    """
+    with connection.transaction():
+        rows = built_rows(connection, join["name"])
+        for column, table_name in (("contract_id", "touched_contracts"), ("id", "touched_profiles")):
+            connection.cursor.execute("DELETE FROM %s WHERE %s IN (SELECT %s FROM %s)"
+                                      % (join["name"], column, column, table_name))
+            rows -= connection.cursor.rowcount
+        connection.cursor.execute(insert_sql(join, "WHERE contract.contract_id IN (SELECT contract_id FROM touched_contracts)"))
+        rows += connection.cursor.rowcount
+        record_build(connection, join["name"], "incremental", version, rows)
+
+
+def refresh_joins(connection, full=False):
+    """
+    Bring every materialized join up to date with the current ingest version.
+    Returns {join name: "full" | "incremental" | "fresh"}.
+    """
+    create_registry(connection)
+    version = manifest.current_version(connection)
+    modes = dict()
+    for join in MATERIALIZED_JOINS:
+        since = built_version(connection, join["name"])
+        touched = None if full or since is None else touched_contracts(connection, since, join["sources"])
+        if touched is None:
+            rebuild(connection, join, version)
+            modes[join["name"]] = "full"
+        elif touched:
+            refresh(connection, join, version)
+            modes[join["name"]] = "incremental"
+        else:
+            modes[join["name"]] = "fresh"
+    return modes
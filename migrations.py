@@ -0,0 +1,99 @@
+"""
+Schema migrations for existing databases. The number of applied migrations
+is kept in PRAGMA user_version; migrate() applies the missing ones in order.
+"""
+from datetime import datetime
+
+import settings
+
+DATE_COLUMNS = {
+    settings.PROFILE_TABLE: ["birth", "issue_date"],
+    settings.CONTRACT_TABLE: ["contract_date"],
+    settings.PAYMENT_TABLE: ["payment_date"],
+}
+
+
+def table_exists(connection, table_name):
+    connection.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [table_name])
+    return connection.cursor.fetchone() is not None
+
+
+def iso_dates(connection):
+    """
+    Rewrite "%m.%d.%Y" dates as ISO "%Y-%m-%d" strings
+    """
+    for table_name, columns in DATE_COLUMNS.items():
+        if not table_exists(connection, table_name):
+            continue
+        for column in columns:
+            # Zero-padded values are converted in one statement, the rest value by value
+            connection.execute_sql("""UPDATE {0} SET {1} = substr({1}, 7, 4) || '-' || substr({1}, 1, 2) || '-' || substr({1}, 4, 2)
+                WHERE {1} GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'""".format(table_name, column))
+            connection.cursor.execute("SELECT DISTINCT {1} FROM {0} WHERE {1} LIKE '%.%.%'".format(table_name, column))
+            updates = [[datetime.strptime(value, settings.SOURCE_DATE_FORMAT).strftime(settings.DATE_FORMAT), value]
+                       for value, in connection.cursor.fetchall()]
+            connection.cursor.executemany("UPDATE {0} SET {1} = ? WHERE {1} = ?".format(table_name, column), updates)
+    # The joined tables are copies of the old values, task1 builds them again
+    connection.execute_sql("DROP TABLE IF EXISTS profile_contract_payment")
+    connection.execute_sql("DROP TABLE IF EXISTS profile_contract")
+
+
+def primary_keys(connection):
+    """
+    Rebuild profile and contract with their primary keys (the last row of a
+    duplicated key wins), drop exact duplicate payments and index them.
+    The values_map indexes come with unique_value_maps.
+    """
+    for table_name in (settings.PROFILE_TABLE, settings.CONTRACT_TABLE):
+        if not table_exists(connection, table_name):
+            continue
+        connection.execute_sql("ALTER TABLE {0} RENAME TO {0}_old".format(table_name))
+        connection.create_table(type_=table_name, commit=False)
+        connection.execute_sql("INSERT OR REPLACE INTO {0} SELECT * FROM {0}_old ORDER BY rowid".format(table_name))
+        connection.execute_sql("DROP TABLE {0}_old".format(table_name))
+    if table_exists(connection, settings.PAYMENT_TABLE):
+        connection.execute_sql("""DELETE FROM payment WHERE rowid NOT IN
+            (SELECT MIN(rowid) FROM payment GROUP BY contract_id, payment_date, amount_due, amount_paid)""")
+        connection.create_table(type_=settings.PAYMENT_TABLE, commit=False)
+
+
+def unique_value_maps(connection):
+    """
+    Drop the duplicate values_map rows left by repeated task1 runs and create
+    its indexes, including the unique (table_name, column_name, key) one
+    """
+    if not table_exists(connection, settings.VALUES_MAP_TABLE):
+        return
+    connection.execute_sql("""DELETE FROM values_map WHERE rowid NOT IN
+        (SELECT MAX(rowid) FROM values_map GROUP BY table_name, column_name, key)""")
+    connection.create_table(type_=settings.VALUES_MAP_TABLE, commit=False)
+
+
+def payment_ids(connection):
+    """
+    Drop loan_performance and default_dates, built before they kept the payment rowid;
+    the next run builds them again
+    """
+    connection.execute_sql("DROP TABLE IF EXISTS %s" % settings.LOAN_PERFORMANCE_TABLE)
+    connection.execute_sql("DROP TABLE IF EXISTS %s" % settings.DEFAULT_DATES_TABLE)
+    if table_exists(connection, settings.MATERIALIZED_TABLE):
+        connection.execute_sql("DELETE FROM %s WHERE name IN ('%s', '%s')" % (
+            settings.MATERIALIZED_TABLE, settings.LOAN_PERFORMANCE_TABLE, settings.DEFAULT_DATES_TABLE))
+
+
+MIGRATIONS = [
+    iso_dates,
+    primary_keys,
+    unique_value_maps,
+    payment_ids,
+]
+
+
+def migrate(connection):
+    connection.cursor.execute("PRAGMA user_version")
+    version = connection.cursor.fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        # Each migration and its version bump are one transaction, DDL included
+        with connection.transaction():
+            migration(connection)
+            connection.cursor.execute("PRAGMA user_version = %d" % number)
@@ -0,0 +1,90 @@
+"""
+Figures of the reports. The draw_* functions fill a given matplotlib figure, so the
+interactive tasks draw on pyplot figures and the headless runner on plain Agg
+figures, rendered in worker processes by Renderer.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+def draw_points(figure, values, ylabel, column, title):
+    axes = figure.add_subplot(111)
+    axes.scatter(list(range(len(values))), values)
+    axes.grid()
+    axes.set_xticks(list(range(len(values))))
+    axes.set_xticklabels(values.index)
+    axes.set_ylabel(ylabel, fontsize=14)
+    axes.set_xlabel(column, fontsize=14)
+    axes.set_title(title, fontsize=16)
+
+
+def draw_woe(figure, df_gb, column):
+    draw_points(figure, df_gb.woe, "WOE", column, "WOE plot")
+
+
+def draw_iv(figure, df_gb, column):
+    draw_points(figure, df_gb.IV, "IV", column, "Information Value plot")
+
+
+def draw_roc(figure, x_plot, y_plot, area):
+    axes = figure.add_subplot(111)
+    axes.plot(x_plot, y_plot, label='ROC curve (area = %0.2f)' % area)
+    axes.plot([0, 1], [0, 1], '--r')
+    axes.set_xlim([0.0, 1.0])
+    axes.set_ylim([0.0, 1.05])
+    axes.set_xlabel('False Positive Rate')
+    axes.set_ylabel('True Positive Rate')
+    axes.set_title('ROC curve')
+    axes.legend(loc="lower right")
+
+
+# kind: (draw function, figure size)
+FIGURES = {
+    "woe": (draw_woe, (12, 7)),
+    "iv": (draw_iv, (12, 7)),
+    "roc": (draw_roc, None),
+}
+
+
+def render(kind, path, *args):
+    """
+    Draw a figure without pyplot and save it to path, returns the seconds it took
+    """
+    start = time.perf_counter()
+    draw, figsize = FIGURES[kind]
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    draw(figure, *args)
+    figure.savefig(path)
+    return time.perf_counter() - start
+
+
+class Renderer:
+    """
+    Renders figures in a process pool while the caller goes on with the numbers.
+    With workers=1 the figures are rendered right away in this process.
+    """
+    def __init__(self, workers=1):
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.futures = []
+        self.timings = []
+
+    def submit(self, kind, path, *args):
+        if self.executor:
+            self.futures.append(self.executor.submit(render, kind, path, *args))
+        else:
+            self.timings.append(render(kind, path, *args))
+
+    def finish(self):
+        """
+        Wait for the figures, returns (figures, seconds spent rendering, seconds waited for them)
+        """
+        start = time.perf_counter()
+        self.timings.extend(future.result() for future in self.futures)
+        if self.executor:
+            self.executor.shutdown()
+        self.futures = []
+        return len(self.timings), sum(self.timings), time.perf_counter() - start
@@ -0,0 +1,285 @@
+"""
+Headless pipeline: tasks 1-4 as a graph of stages run in one process.
+
+Usage: python runner.py [--config runner.json] [--horizon 12] [--output out] [--stages roc woe] [--force]
+
+Every parameter can come from the JSON config (same names, e.g. {"horizon": 24,
+"stages": ["woe"]}); command line values win. Frames are handed from stage to
+stage in memory. A stage is skipped when its parameters and the signatures of
+the stages it depends on are the same as on its last successful run; its result
+is then read back from the database only if a later stage needs it.
+Figures are rendered by worker processes (see reports.Renderer) while the
+stages go on.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import manifest
+import settings
+from connections import get_connection
+
+# pandas, matplotlib, sklearn and the task modules are imported by the stages that use
+# them, so a run where everything is skipped starts fast.
+
+DEFAULTS = {
+    "horizon": 12,
+    "horizons": list(settings.DEFAULT_HORIZONS),
+    "output": "out",
+    "stages": ["roc", "woe"],
+    "workers": settings.INGEST_WORKERS,
+    "woe_workers": 1,
+    "render_workers": 2,
+    "full_refresh": False,
+    "force": False,
+}
+
+
+def source_signature(data_path):
+    """
+    Paths, sizes and mtimes of the source workbooks; changes whenever a file does
+    """
+    entries = []
+    for directory, _, files in os.walk(data_path):
+        for file_name in files:
+            path = os.path.join(directory, file_name)
+            stat = os.stat(path)
+            entries.append([os.path.relpath(path, data_path), stat.st_size, stat.st_mtime_ns])
+    return sorted(entries)
+
+
+def run_ingest(context, config):
+    import task1
+    task1.main(workers=config["workers"], full_refresh=config["full_refresh"])
+    return manifest.current_version(context.connection)
+
+
+def run_performance(context, config):
+    from loans import refresh_performance
+    # The later stages read the stored tables in parts, only the version is kept
+    return refresh_performance(context.connection)
+
+
+def run_defaults(context, config):
+    from loans import client_defaults, default_matrix, horizon_defaults, horizon_payments, load_default_dates, store_defaults
+    context.result("performance")
+    horizons = sorted(set(config["horizons"]) | {config["horizon"]})
+    matrix = default_matrix(horizon_payments(context.connection, horizons), load_default_dates(context.connection), horizons)
+    rollup = client_defaults(matrix)
+    store_defaults(context.connection, matrix, rollup)
+    out_df_gb = horizon_defaults(rollup, config["horizon"])
+    out_df_gb.rename({"age": "Age (months)"}, axis=1).to_csv(context.output("defaults_horizon.csv"))
+    return out_df_gb
+
+
+def load_defaults_result(context, config):
+    from loans import load_defaults
+    out_df_gb = load_defaults(context.connection, config["horizon"])
+    # The stored horizons may have been replaced by an interactive run since
+    return out_df_gb if len(out_df_gb) else None
+
+
+def run_rollrates(context, config):
+    from loans import contract_types, performance_roll_rates, roll_rate_matrix, store_roll_rates
+    context.result("performance")
+    rates = performance_roll_rates(context.connection, contract_types(context.connection))
+    store_roll_rates(context.connection, rates)
+    rates.to_csv(context.output("roll_rates.csv"), index=False)
+    matrix = roll_rate_matrix(rates)
+    matrix.to_csv(context.output("roll_rate_matrix.csv"))
+    print(matrix.round(3))
+
+
+def run_woe(context, config):
+    from woe import iv_summary, load_applications, save_tables, woe_tables
+    out_df_gb = context.result("defaults")
+    applications_df = load_applications(context.connection, out_df_gb[out_df_gb['Default?']].id_number.unique())
+    tables = woe_tables(applications_df, workers=config["woe_workers"])
+    summary = iv_summary(tables)
+    save_tables(context.connection, tables, summary, context.output("woe"))
+    for feature, table in tables.items():
+        context.renderer.submit("woe", context.output(os.path.join("woe", "woe_%s.png" % feature)), table, feature)
+        context.renderer.submit("iv", context.output(os.path.join("woe", "iv_%s.png" % feature)), table, feature)
+    print(summary.to_string(index=False))
+
+
+def run_scores(context, config):
+    from task3 import export_scores, rescore_profiles
+    mode, rows = rescore_profiles(context.connection, full=config["full_refresh"])
+    print("Scored %d profiles (%s)" % (rows, mode))
+    export_scores(context.connection, context.output("clients_scores.csv"))
+
+
+def load_table(table_name):
+    def load(context, config):
+        import pandas as pd
+        return pd.read_sql_query("SELECT * FROM %s" % table_name, context.connection.connection)
+    return load
+
+
+def run_totals(context, config):
+    # The scores stage keeps total_scores up to date
+    totals = load_table(settings.TOTAL_SCORES_TABLE)(context, config)
+    totals.to_csv(context.output("total_scores.csv"))
+    return totals
+
+
+def run_roc(context, config):
+    import matplotlib
+    import pandas as pd
+    from sklearn.metrics import auc
+    # task4 imports pyplot: no windows, the figures are only saved
+    matplotlib.use("Agg")
+    from task4 import roc_points
+    out_df_gb = context.result("defaults")
+    if out_df_gb['Default?'].nunique() < 2:
+        print("ROC skipped: the %d months horizon needs both defaulted and other clients" % config["horizon"])
+        return
+    x_plot, y_plot = roc_points(out_df_gb, context.result("totals"))
+    area = auc(x_plot, y_plot)
+    pd.DataFrame({"fpr": x_plot, "tpr": y_plot}).to_csv(context.output("roc_points.csv"), index=False)
+
+    context.renderer.submit("roc", context.output("roc_plot.png"), x_plot, y_plot, area)
+    print("ROC AUC on %d months: %.4f" % (config["horizon"], area))
+
+
+# name: (stages it depends on, parameters it depends on, run, load the stored result)
+STAGES = OrderedDict([
+    ("ingest", ([], [], run_ingest, lambda context, config: manifest.current_version(context.connection))),
+    ("performance", (["ingest"], [], run_performance, run_performance)),
+    ("defaults", (["performance"], ["horizon", "horizons", "output"], run_defaults, load_defaults_result)),
+    ("rollrates", (["performance"], ["output"], run_rollrates, None)),
+    ("woe", (["defaults"], ["output"], run_woe, None)),
+    ("scores", (["ingest"], ["output"], run_scores, load_table(settings.CLIENT_SCORES_TABLE))),
+    ("totals", (["scores"], ["output"], run_totals, load_table(settings.TOTAL_SCORES_TABLE))),
+    ("roc", (["defaults", "totals"], ["output"], run_roc, None)),
+])
+
+
+def plan(targets):
+    """
+    The requested stages and everything they depend on, in dependency order
+    """
+    needed = set()
+
+    def visit(name):
+        if name not in STAGES:
+            raise Exception("Unknown stage %s, expected one of: %s" % (name, ", ".join(STAGES)))
+        if name not in needed:
+            needed.add(name)
+            for dependency in STAGES[name][0]:
+                visit(dependency)
+
+    for target in targets:
+        visit(target)
+    return [name for name in STAGES if name in needed]
+
+
+class Context:
+    def __init__(self, connection, config):
+        self.connection = connection
+        self.config = config
+        self.results = dict()
+        self.signatures = dict()
+        self._renderer = None
+
+    @property
+    def renderer(self):
+        # Started with the first figure, so runs without figures do not spawn workers
+        if self._renderer is None:
+            from reports import Renderer
+            self._renderer = Renderer(self.config["render_workers"])
+        return self._renderer
+
+    def output(self, file_name):
+        os.makedirs(self.config["output"], exist_ok=True)
+        return os.path.join(self.config["output"], file_name)
+
+    def result(self, name):
+        # Results of skipped stages (and of the ones that keep their result only in the
+        # database) are read back on first use
+        if self.results.get(name) is None:
+            self.results[name] = STAGES[name][3](self, self.config)
+            if self.results[name] is None:
+                self.results[name] = STAGES[name][2](self, self.config)
+        return self.results[name]
+
+
+def stage_signature(context, name):
+    dependencies, parameters, _, _ = STAGES[name]
+    payload = {"parameters": [context.config[parameter] for parameter in parameters],
+               "dependencies": [context.signatures[dependency] for dependency in dependencies]}
+    if name == "ingest":
+        payload["sources"] = source_signature(settings.DATA_DIR)
+    elif name == "scores":
+        # The age of the applicants moves on every day
+        payload["date"] = datetime.now().strftime(settings.DATE_FORMAT)
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def stored_signature(connection, name):
+    connection.cursor.execute("SELECT signature FROM %s WHERE stage = ?" % settings.RUNNER_TABLE, [name])
+    row = connection.cursor.fetchone()
+    return row[0] if row else None
+
+
+def run(config):
+    connection = get_connection()
+    connection.create_table(type_=settings.RUNNER_TABLE)
+    context = Context(connection, config)
+    for name in plan(config["stages"]):
+        context.signatures[name] = stage_signature(context, name)
+        # A full refresh of the joined tables always re-runs the ingest
+        force = config["force"] or (name == "ingest" and config["full_refresh"])
+        if not force and stored_signature(connection, name) == context.signatures[name]:
+            print("%-12s skipped (inputs unchanged)" % name)
+            continue
+        start = time.perf_counter()
+        context.results[name] = STAGES[name][2](context, config)
+        connection.cursor.execute("INSERT OR REPLACE INTO %s VALUES (?, ?, ?)" % settings.RUNNER_TABLE,
+                                  [name, context.signatures[name], datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+        connection.commit()
+        print("%-12s done in %.2fs" % (name, time.perf_counter() - start))
+    if context._renderer is not None:
+        figures, rendering, waited = context._renderer.finish()
+        print("Rendered %d figures: %.2fs of rendering, %.2fs waited for it" % (figures, rendering, waited))
+    return context
+
+
+def parse_config(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", help="JSON file with any of the options below")
+    parser.add_argument("--horizon", type=int, help="risk horizon in months (default: 12)")
+    parser.add_argument("--horizons", type=int, nargs="+", help="horizons of the stored default matrix")
+    parser.add_argument("--output", help="folder for the CSV files and plots (default: out)")
+    parser.add_argument("--stages", nargs="+", help="stages to bring up to date: %s (default: roc woe)" % ", ".join(STAGES))
+    parser.add_argument("--workers", type=int, help="processes parsing the workbooks")
+    parser.add_argument("--woe-workers", dest="woe_workers", type=int, help="processes computing the WOE tables")
+    parser.add_argument("--render-workers", dest="render_workers", type=int,
+                        help="processes rendering the figures (1 - render in the runner itself)")
+    parser.add_argument("--full-refresh", dest="full_refresh", action="store_true", default=None,
+                        help="rebuild the joined tables from scratch")
+    parser.add_argument("--force", action="store_true", default=None, help="run the stages even if nothing changed")
+    args = parser.parse_args(argv)
+
+    config = dict(DEFAULTS)
+    if args.config:
+        with open(args.config) as file:
+            config.update(json.load(file))
+    config.update({key: value for key, value in vars(args).items() if key != "config" and value is not None})
+    return config
+
+
+def main(argv=None):
+    start = time.perf_counter()
+    settings.init()
+    run(parse_config(argv))
+    print("Pipeline done in %.2fs" % (time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
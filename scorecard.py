@@ -0,0 +1,239 @@
+"""
+Scorecard of the applicants: points of every feature and the weighted total score.
+
+SCORECARD describes the points declaratively, compile_scorecard turns it into
+array lookups once and score_points applies them to whole columns.
+
+A feature gets its points by one of:
+  bins       - right-open intervals between the edges, "points" has one value more
+               than "bins"; missing values (NaN, '') get "missing"
+  categories - {value: points}, every other value gets "default"
+  flag       - "flag" points for a true value, 0 for a false one
+
+score_applicant does the same for a single applicant with plain Python lookups,
+for scoring one application at a time (see scoring_server.py).
+"""
+import datetime
+import math
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+SCORECARD = [
+    # Ages below 18 share the points of [55, inf)
+    {"feature": "age", "bins": [18, 25, 35, 55], "points": [15, 10, 20, 25, 15], "missing": 0},
+    {"feature": "family", "categories": {1: 10, 2: 15, 3: 25, 4: 20}, "default": 0},
+    {"feature": "income", "bins": [40000, 100000, 200000, 500000], "points": [5, 10, 15, 20, 25], "missing": 0},
+    # Unknown (NaN) counts as owning a house
+    {"feature": "house_ownership", "flag": 25},
+    {"feature": "age_of_car", "bins": [1, 3], "points": [25, 15, 5], "missing": 0},
+    {"feature": "employed_by", "categories": {
+        "Business Entity Type 3": 25,
+        "Business Entity Type 2": 25,
+        "Government": 20,
+        "Military": 5,
+        "Security Ministries": 15,
+        "Emergency": 5,
+        "Security": 5,
+        "Construction": 5,
+        "Electricity": 5,
+        "XNA": 0,
+        "Other": 0,
+    }, "default": 10},
+    {"feature": "education", "categories": {
+        "Higher education": 25,
+        "Secondary / secondary special": 10,
+        "Incomplete higher": 20,
+    }, "default": 0},
+    {"feature": "marital_status", "categories": {
+        "Married": 25,
+        "Single / not married": 10,
+        "Civil marriage": 15,
+        "Widow": 5,
+        "Separated": 5,
+    }, "default": 0},
+    {"feature": "position", "categories": {
+        "Core staff": 25,
+        "Accountants": 25,
+        "Managers": 25,
+        "Security staff": 10,
+        "<undefined>": 0,
+    }, "default": 15},
+    {"feature": "income_type", "categories": {
+        "State servant": 15,
+        "Working": 10,
+        "Commercial associate": 25,
+        "Pensioner": 5,
+    }, "default": 0},
+    {"feature": "housing", "categories": {
+        "House / apartment": 25,
+        "Rented apartment": 15,
+        "With parents": 10,
+    }, "default": 0},
+]
+
+SCORE_COLUMNS = [rule["feature"] for rule in SCORECARD]
+
+# Weights of the points in the total score, proportional to the IV of the features
+SCORE_WEIGHTS = {
+    "age": 0.4919,
+    "age_of_car": 0.3890,
+    "education": 0.0389,
+    "employed_by": 1.0320,
+    "family": 0.3844,
+    "house_ownership": 0.0023,
+    "housing": 0.1372,
+    "income": 0.4485,
+    "income_type": 0.2288,
+    "marital_status": 0.1281,
+    "position": 0.7185,
+}
+
+
+def bin_scorer(edges, points, missing):
+    edges = np.asarray(edges, dtype=float)
+    # The last entry is for the missing values
+    points = np.append(points, missing).astype(np.int8)
+
+    def score(values):
+        values = pd.to_numeric(pd.Series(values), errors="coerce").values.astype(float)
+        positions = np.searchsorted(edges, values, side="right")
+        positions[np.isnan(values)] = len(points) - 1
+        return points[positions]
+    return score
+
+
+def category_scorer(categories, default):
+    index = pd.Index(list(categories.keys()))
+    # get_indexer gives -1 for other values, which picks the default
+    points = np.append(list(categories.values()), default).astype(np.int8)
+
+    def score(values):
+        values = pd.Series(values)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # One lookup per category, the codes (-1 - NaN) pick from them
+            by_category = np.append(points[index.get_indexer(values.cat.categories)], points[-1])
+            return by_category[values.cat.codes.values]
+        return points[index.get_indexer(values)]
+    return score
+
+
+def flag_scorer(points):
+    def score(values):
+        values = pd.Series(values)
+        # Same truth as bool(value): NaN is true, None and '' are false
+        flags = values.map(bool).values if values.dtype == object else values.values.astype(bool)
+        return np.where(flags, points, 0).astype(np.int8)
+    return score
+
+
+def compile_scorecard(spec=SCORECARD):
+    """
+    [(feature, function from the column values to an array of points)]
+    """
+    scorers = []
+    for rule in spec:
+        if "bins" in rule:
+            if len(rule["points"]) != len(rule["bins"]) + 1:
+                raise Exception("Scorecard feature %s needs one point more than bins" % rule["feature"])
+            scorer = bin_scorer(rule["bins"], rule["points"], rule["missing"])
+        elif "categories" in rule:
+            scorer = category_scorer(rule["categories"], rule["default"])
+        elif "flag" in rule:
+            scorer = flag_scorer(rule["flag"])
+        else:
+            raise Exception("Scorecard feature %s has no bins, categories or flag" % rule["feature"])
+        scorers.append((rule["feature"], scorer))
+    return scorers
+
+
+_compiled = compile_scorecard()
+
+
+def score_points(profile_data, scorers=None):
+    """
+    Points of every profile on every feature, one row per client. profile_data has the
+    id, the age in years and the categorical columns decoded into their labels.
+    The points (0-25) are int8.
+    """
+    points = pd.DataFrame({"id": profile_data.id.values})
+    for feature, score in scorers or _compiled:
+        points[feature] = score(profile_data[feature].values)
+    return points
+
+
+def total_scores(clients_scores):
+    """
+    Weighted sum of the scorecard points of every client
+    """
+    total = 0
+    for column_name, weight in SCORE_WEIGHTS.items():
+        total = total + clients_scores[column_name].values * weight
+    return pd.DataFrame({"id": clients_scores.id.values, "total_score": total}, index=clients_scores.index)
+
+
+def number(value):
+    # float of the value, None for missing ones ('', None, NaN, not a number)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def applicant_scorer(rule):
+    if "bins" in rule:
+        edges, points, missing = list(rule["bins"]), list(rule["points"]), rule["missing"]
+
+        def score(value):
+            value = number(value)
+            return missing if value is None else points[bisect_right(edges, value)]
+    elif "categories" in rule:
+        categories, default = dict(rule["categories"]), rule["default"]
+
+        def score(value):
+            # NaN is never equal to a key
+            return categories.get(value, default) if value == value else default
+    else:
+        points = rule["flag"]
+
+        def score(value):
+            return points if value else 0
+    return score
+
+
+def compile_applicant_scorecard(spec=SCORECARD):
+    """
+    [(feature, function from a single value to its points, weight)] in the order of SCORE_WEIGHTS
+    """
+    scorers = dict((rule["feature"], applicant_scorer(rule)) for rule in spec)
+    return [(feature, scorers[feature], weight) for feature, weight in SCORE_WEIGHTS.items()]
+
+
+_applicant_compiled = compile_applicant_scorecard()
+
+
+def applicant_age(applicant):
+    if "age" in applicant:
+        return applicant["age"]
+    birth = applicant.get("birth")
+    if not birth:
+        return None
+    birth = datetime.datetime.strptime(birth, "%Y-%m-%d").date() if isinstance(birth, str) else birth
+    return (datetime.date.today() - birth).days // 365
+
+
+def score_applicant(applicant, scorers=None):
+    """
+    Points and total score of one applicant given as a dict of the profile columns, with the
+    categorical ones as labels and either the age in years or the birth date (ISO string or date).
+    Missing columns score as missing values. Returns {"points": {feature: points}, "total_score": total}.
+    """
+    points = dict()
+    total = 0
+    for feature, score, weight in scorers or _applicant_compiled:
+        value = applicant_age(applicant) if feature == "age" else applicant.get(feature)
+        points[feature] = score(value)
+        total = total + points[feature] * weight
+    return {"points": points, "total_score": total}
@@ -0,0 +1,76 @@
+"""
+Local HTTP endpoint scoring one application at a time.
+
+Usage: python scoring_server.py [--host 127.0.0.1] [--port 8000]
+
+POST /score with a JSON object of the profile columns (categorical ones as labels,
+"age" in years or "birth" as YYYY-MM-DD), e.g.
+    {"birth": "1980-02-03", "family": 2, "income": 55000, "house_ownership": 1,
+     "age_of_car": 2, "employed_by": "Government", "education": "Higher education",
+     "marital_status": "Married", "position": "Managers", "income_type": "Working",
+     "housing": "House / apartment"}
+answers {"points": {feature: points}, "total_score": total}, see scorecard.score_applicant.
+"""
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from scorecard import score_applicant
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a client can send many applications over one connection
+    protocol_version = "HTTP/1.1"
+    # The headers and the body go out as separate writes, Nagle would hold the body back
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path != "/score":
+            return self.reply(404, {"error": "unknown path %s, POST to /score" % self.path})
+        try:
+            applicant = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            if not isinstance(applicant, dict):
+                raise ValueError("expected a JSON object with the applicant")
+            result = score_applicant(applicant)
+        except (TypeError, ValueError) as e:
+            return self.reply(400, {"error": str(e)})
+        self.reply(200, result)
+
+    def reply(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ScoringServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(host="127.0.0.1", port=8000):
+    server = ScoringServer((host, port), ScoringHandler)
+    print("Scoring on http://%s:%d/score" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    serve(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,14 +7,65 @@ DATABASE_NAME = "origin.db"
 DATABASE_PATH = os.path.join(DATABASE_DIR, DATABASE_NAME)
 PAYMENTS_PATH = os.path.join(DATA_DIR, 'payments.xls')
 
-if not os.path.exists(DATA_DIR):
-    raise Exception("DATA_DIR is missing")
-if not os.path.exists(DATABASE_DIR):
-    os.makedirs(DATABASE_DIR)
-
 PROFILE_TABLE = 'profile'
 CONTRACT_TABLE = 'contract'
 PAYMENT_TABLE = 'payment'
 CLIENT_SCORES_TABLE = 'client_scores'
 TOTAL_SCORES_TABLE = 'total_scores'
 VALUES_MAP_TABLE = 'values_map'
+MANIFEST_TABLE = 'source_manifest'
+REPLACED_KEYS_TABLE = 'replaced_keys'
+PROFILE_CONTRACT_TABLE = 'profile_contract'
+PROFILE_CONTRACT_PAYMENT_TABLE = 'profile_contract_payment'
+MATERIALIZED_TABLE = 'materialized_tables'
+LOAN_PERFORMANCE_TABLE = 'loan_performance'
+CONTRACT_DEFAULTS_TABLE = 'contract_defaults'
+CLIENT_DEFAULTS_TABLE = 'client_defaults'
+WOE_SUMMARY_TABLE = 'woe_iv_summary'
+WOE_TABLE = 'woe_tables'
+RUNNER_TABLE = 'runner_stages'
+ROLL_RATES_TABLE = 'roll_rates'
+DEFAULT_DATES_TABLE = 'default_dates'
+
+# Dates are stored as sortable ISO strings, workbooks use SOURCE_DATE_FORMAT
+DATE_FORMAT = "%Y-%m-%d"
+SOURCE_DATE_FORMAT = "%m.%d.%Y"
+
+# Number of processes used to parse the profile/contract workbooks (1 - sequential)
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 1))
+INGEST_CHUNK_SIZE = 16
+INSERT_BATCH_SIZE = 1000
+PAYMENTS_CHUNK_SIZE = 50000
+
+# From this many payments loans.refresh_performance streams them by contract in chunks
+STREAM_PAYMENT_ROWS = 1000000
+STREAM_CHUNK_SIZE = 100000
+
+# Profiles scored at a time by task3.stream_scores
+SCORE_CHUNK_SIZE = 50000
+
+# Risk horizons (months since the contract date) of the stored default matrix
+DEFAULT_HORIZONS = (3, 6, 12, 24)
+
+# Below this many applicants woe.woe_tables stays in one process
+WOE_PARALLEL_ROWS = 100000
+
+# Applied to every connection handed out by connections.get_connection.
+# WAL lets the analytics tasks read while an ingest is writing.
+SQLITE_PRAGMAS = [
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -65536),  # negative - in KiB
+    ("mmap_size", 268435456),
+    ("temp_store", "MEMORY"),
+]
+
+
+def init():
+    """
+    Check the project folders; called by the entry points, not on import
+    """
+    if not os.path.exists(DATA_DIR):
+        raise Exception("DATA_DIR is missing")
+    if not os.path.exists(DATABASE_DIR):
+        os.makedirs(DATABASE_DIR)
@@ -1,206 +1,22 @@
 import pandas as pd
 import datetime
+from contextlib import contextmanager
+import manifest
 import settings
-from general import DBhandler
+from connections import get_connection
+from materialize import built_on, built_version, record_build
 
-from utils import convert_data_from_categorical, export_data, parse_date
+from scorecard import SCORE_COLUMNS, score_points, total_scores
+from utils import compact_frame, convert_data_from_categorical, export_data
 
 
-def main():
-    def age_category(age):
-        if 18 <= age < 25:
-            return '[18, 25)'
-        elif 25 <= age < 35:
-            return '[25, 35)'
-        elif 35 <= age < 55:
-            return '[35, 55)'
-        elif age != age:
-            return 'None'
-        else:
-            return '[55, inf)'
-
-    def income_category(income):
-        if isinstance(income, str) and not len(income):
-            income = float('nan')
-        else:
-            income = float(income)
-        if income < 40000:
-            return '[0-40000)'
-        elif 40000 <= income < 100000:
-            return '[40000, 100000)'
-        elif 100000 <= income < 200000:
-            return '[100000, 200000)'
-        elif 200000 <= income < 500000:
-            return '[200000, 500000)'
-        elif income != income:
-            return 'None'
-        else:
-            return '[500000, inf)'
-
-    def age_of_car_category(age_of_car):
-        if isinstance(age_of_car, str) and not len(age_of_car):
-            age_of_car = float('nan')
-        else:
-            age_of_car = float(age_of_car)
-        if age_of_car < 1:
-            return '[0, 1)'
-        elif 1 <= age_of_car < 3:
-            return '[1, 3)'
-        elif age_of_car != age_of_car:
-            return 'None'
-        else:
-            return '[3, inf)'
-
-    def score_client(client):
-        def age_score(age):
-            if age == '[18, 25)':
-                return 10
-            elif age == '[25, 35)':
-                return 20
-            elif age == '[35, 55)':
-                return 25
-            elif age == 'None':
-                return 0
-            elif age == '[55, inf)':
-                return 15
-
-        def family_score(family):
-            if family == 1:
-                return 10
-            elif family == 2:
-                return 15
-            elif family == 3:
-                return 25
-            elif family == 4:
-                return 20
-            else:
-                return 0
-
-        def income_score(income):
-            if income == '[0-40000)':
-                return 5
-            elif income == '[40000, 100000)':
-                return 10
-            elif income == '[100000, 200000)':
-                return 15
-            elif income == '[200000, 500000)':
-                return 20
-            elif income == 'None':
-                return 0
-            elif income == '[500000, inf)':
-                return 25
-
-        def house_ownership_score(house_ownership):
-            if house_ownership:
-                return 25
-            else:
-                return 0
-
-        def age_of_car_score(age_of_car):
-                if age_of_car == '[0, 1)':
-                    return 25
-                elif age_of_car == '[1, 3)':
-                    return 15
-                elif age_of_car == 'None':
-                    return 0
-                elif age_of_car == '[3, inf)':
-                    return 5
-
-        def employed_by_score(employed_by):
-            employed_by_score_dict = {
-                "Business Entity Type 3": 25,
-                "Business Entity Type 2": 25,
-                "Government": 20,
-                "Military": 5,
-                "Security Ministries": 15,
-                "Emergency": 5,
-                "Security": 5,
-                "Construction": 5,
-                "Electricity": 5,
-                "XNA": 0,
-                "Other": 0,
-            }
-            return employed_by_score_dict.get(employed_by, 10)
-
-        def education_score(education):
-            if education == "Higher education":
-                return 25
-            elif education == "Secondary / secondary special":
-                return 10
-            elif education == "Incomplete higher":
-                return 20
-            else:
-                return 0
-
-        def marital_status_score(marital_status):
-            if marital_status == "Married":
-                return 25
-            elif marital_status == "Single / not married":
-                return 10
-            elif marital_status == "Civil marriage":
-                return 15
-            elif marital_status == "Widow":
-                return 5
-            elif marital_status == "Separated":
-                return 5
-            else:
-                return 0
-
-        def position_score(position):
-            if position == "Core staff":
-                return 25
-            elif position == "Accountants":
-                return 25
-            elif position == "Managers":
-                return 25
-            elif position == "Security staff":
-                return 10
-            elif position == "<undefined>":
-                return 0
-            else:
-                return 15
-
-        def income_type_score(income_type):
-            if income_type == "State servant":
-                return 15
-            if income_type == "Working":
-                return 10
-            if income_type == "Commercial associate":
-                return 25
-            if income_type == "Pensioner":
-                return 5
-            else:
-                return 0
-
-        def housing_score(housing):
-            if housing == "House / apartment":
-                return 25
-            elif housing == "Rented apartment":
-                return 15
-            elif housing == "With parents":
-                return 10
-            else:
-                return 0
-
-        score_dict = dict()
-        score_dict['age'] = age_score(client.age)
-        score_dict['family'] = family_score(client.family)
-        score_dict['income'] = income_score(client.income)
-        score_dict['house_ownership'] = house_ownership_score(client.house_ownership)
-        score_dict['age_of_car'] = age_of_car_score(client.age_of_car)
-        score_dict['employed_by'] = employed_by_score(client.employed_by)
-        score_dict['education'] = education_score(client.education)
-        score_dict['marital_status'] = marital_status_score(client.marital_status)
-        score_dict['position'] = position_score(client.position)
-        score_dict['income_type'] = income_type_score(client.income_type)
-        score_dict['housing'] = housing_score(client.housing)
-        return score_dict
-
-    db_connection = DBhandler(db_path=settings.DATABASE_PATH)
-
-    profile_data = pd.read_sql_query("SELECT * FROM %s" % settings.PROFILE_TABLE, db_connection.connection)
-    profile_data.birth = profile_data.birth.apply(parse_date)
-    profile_data['age'] = profile_data.birth.apply(lambda x: (datetime.date.today() - x).days // 365)
+def prepare_profiles(connection, profile_data):
+    """
+    Age in years and the categorical columns decoded into their labels, as score_points expects.
+    The labels are pandas Categorical and the integer columns are downcast (see utils.compact_frame).
+    """
+    # to_datetime: a chunk may have no dates at all (or no rows), then parse_dates leaves the column as is
+    profile_data['age'] = (pd.Timestamp(datetime.date.today()) - pd.to_datetime(profile_data.birth)).dt.days // 365
 
     used_columns = ['employed_by',
                     'education',
@@ -210,52 +26,146 @@ def main():
                     'housing']
 
     for column in used_columns:
-        profile_data[column] = convert_data_from_categorical(profile_data[column].values, column)
+        profile_data[column] = convert_data_from_categorical(profile_data[column].values, column, connection)
+    return compact_frame(profile_data, categorical=['gender'],
+                         integers=['id', 'children', 'family', 'age_of_car', 'house_ownership', 'age'])
+
+
+def create_scores_table(connection, table_name):
+    # SQLite keeps the points in one byte whatever the type, TINYINT documents their range
+    columns = ", ".join("%s TINYINT" % column for column in SCORE_COLUMNS)
+    connection.execute_sql("CREATE TABLE %s (id INTEGER NOT NULL PRIMARY KEY, %s)" % (table_name, columns))
+
+
+def insert_scores(connection, table_name, score_table, verb="INSERT"):
+    columns = ['id'] + SCORE_COLUMNS
+    connection.cursor.executemany("%s INTO %s (%s) VALUES (%s)" % (verb, table_name, ", ".join(columns),
+                                                                   ", ".join("?" * len(columns))),
+                                  zip(*[score_table[column].tolist() for column in columns]))
+
+
+def insert_total_scores(connection, totals, verb="INSERT"):
+    connection.cursor.executemany("%s INTO %s (id, total_score) VALUES (?, ?)" % (verb, settings.TOTAL_SCORES_TABLE),
+                                  zip(totals.id.tolist(), totals.total_score.tolist()))
+
+
+@contextmanager
+def replacing_scores(connection):
+    """
+    Yield the name of an empty table to fill with the scores; it replaces client_scores
+    in the same transaction, so readers see the old scores until the new ones are complete
+    """
+    staging_table = settings.CLIENT_SCORES_TABLE + "_new"
+    with connection.transaction():
+        connection.execute_sql("DROP TABLE IF EXISTS %s" % staging_table)
+        create_scores_table(connection, staging_table)
+        yield staging_table
+        connection.execute_sql("DROP TABLE IF EXISTS %s" % settings.CLIENT_SCORES_TABLE)
+        connection.execute_sql("ALTER TABLE %s RENAME TO %s" % (staging_table, settings.CLIENT_SCORES_TABLE))
+
+
+def stream_scores(connection, chunk_size=settings.SCORE_CHUNK_SIZE):
+    """
+    Score the profiles chunk_size at a time straight into client_scores, returns the number of clients
+    """
+    rows = 0
+    with replacing_scores(connection) as table_name:
+        for profile_data in pd.read_sql_query("SELECT * FROM %s ORDER BY id" % settings.PROFILE_TABLE,
+                                              connection.connection, parse_dates=['birth'], chunksize=chunk_size):
+            insert_scores(connection, table_name, score_points(prepare_profiles(connection, profile_data)))
+            rows += len(profile_data)
+    return rows
+
+
+def export_scores(connection, path, chunk_size=settings.SCORE_CHUNK_SIZE):
+    """
+    Write client_scores ordered by id to a CSV file chunk by chunk, the rows numbered from 0
+    """
+    offset = 0
+    for score_table in pd.read_sql_query("SELECT * FROM %s ORDER BY id" % settings.CLIENT_SCORES_TABLE,
+                                         connection.connection, chunksize=chunk_size):
+        score_table.index += offset
+        score_table.to_csv(path, mode="a" if offset else "w", header=not offset)
+        offset += len(score_table)
+
+
+def replace_total_scores(connection, chunk_size=settings.SCORE_CHUNK_SIZE):
+    """
+    Rebuild total_scores from client_scores chunk by chunk
+    """
+    with connection.transaction():
+        connection.execute_sql("DROP TABLE IF EXISTS %s" % settings.TOTAL_SCORES_TABLE)
+        connection.create_table(type_=settings.TOTAL_SCORES_TABLE)
+        for score_table in pd.read_sql_query("SELECT * FROM %s ORDER BY id" % settings.CLIENT_SCORES_TABLE,
+                                             connection.connection, chunksize=chunk_size):
+            insert_total_scores(connection, total_scores(score_table))
+
+
+def profiles_to_rescore(connection, since_version, scored_on):
+    """
+    Ids of the profiles ingested after since_version and of the ones whose age in years
+    changed since scored_on (YYYY-MM-DD)
+    """
+    connection.cursor.execute("SELECT row_key FROM %s WHERE table_name = ? AND ingest_version > ?"
+                              % settings.MANIFEST_TABLE, [settings.PROFILE_TABLE, since_version])
+    ids = set(row[0] for row in connection.cursor.fetchall())
+    today = datetime.date.today().strftime(settings.DATE_FORMAT)
+    if scored_on != today:
+        connection.cursor.execute("""SELECT id FROM %s
+            WHERE CAST(julianday(?) - julianday(birth) AS INTEGER) / 365 != CAST(julianday(?) - julianday(birth) AS INTEGER) / 365"""
+                                  % settings.PROFILE_TABLE, [today, scored_on])
+        ids.update(row[0] for row in connection.cursor.fetchall())
+    return sorted(ids)
+
+
+def rescore_profiles(connection, full=False, chunk_size=settings.SCORE_CHUNK_SIZE):
+    """
+    Bring client_scores and total_scores up to date with the profile table. Only the profiles
+    that are new or changed since the last scoring (see manifest.py), or whose age changed,
+    are scored and upserted; full=True, or tables not built by this function, score everyone.
+    Returns ("full" | "incremental", number of profiles scored).
+    """
+    version = manifest.current_version(connection)
+    since = built_version(connection, settings.CLIENT_SCORES_TABLE)
+    if full or since is None or built_version(connection, settings.TOTAL_SCORES_TABLE) != since:
+        rows = stream_scores(connection, chunk_size)
+        replace_total_scores(connection, chunk_size)
+        with connection.transaction():
+            record_build(connection, settings.CLIENT_SCORES_TABLE, "full", version)
+            record_build(connection, settings.TOTAL_SCORES_TABLE, "full", version)
+        return "full", rows
+
+    ids = profiles_to_rescore(connection, since, built_on(connection, settings.CLIENT_SCORES_TABLE))
+    with connection.transaction():
+        connection.execute_sql("CREATE TEMP TABLE IF NOT EXISTS rescored_profiles (id INTEGER PRIMARY KEY)")
+        connection.execute_sql("DELETE FROM rescored_profiles")
+        connection.cursor.executemany("INSERT INTO rescored_profiles VALUES (?)", [[key] for key in ids])
+        for profile_data in pd.read_sql_query("SELECT * FROM %s WHERE id IN (SELECT id FROM rescored_profiles) ORDER BY id"
+                                              % settings.PROFILE_TABLE, connection.connection,
+                                              parse_dates=['birth'], chunksize=chunk_size):
+            score_table = score_points(prepare_profiles(connection, profile_data))
+            insert_scores(connection, settings.CLIENT_SCORES_TABLE, score_table, "INSERT OR REPLACE")
+            insert_total_scores(connection, total_scores(score_table), "INSERT OR REPLACE")
+        # Profiles replaced by a workbook with another id
+        for table_name in (settings.CLIENT_SCORES_TABLE, settings.TOTAL_SCORES_TABLE):
+            connection.execute_sql("DELETE FROM %s WHERE id NOT IN (SELECT id FROM %s)"
+                                   % (table_name, settings.PROFILE_TABLE))
+        record_build(connection, settings.CLIENT_SCORES_TABLE, "incremental", version)
+        record_build(connection, settings.TOTAL_SCORES_TABLE, "incremental", version)
+    return "incremental", len(ids)
 
-    profile_data['age'] = profile_data.age.apply(age_category)
-    profile_data['income'] = profile_data.income.apply(income_category)
-    profile_data['age_of_car'] = profile_data.age_of_car.apply(age_of_car_category)
 
-    score_table = pd.DataFrame([], columns=['id',
-                                            'age',
-                                            'family',
-                                            'income',
-                                            'house_ownership',
-                                            'age_of_car',
-                                            'employed_by',
-                                            'education',
-                                            'marital_status',
-                                            'position',
-                                            'income_type',
-                                            'housing',
-                                            ])
-
-    curr_pos = 0
-    for i in range(len(profile_data)):
-        client = profile_data.iloc[i]
-        score_dict = score_client(client)
-        score_table.loc[curr_pos] = [
-            client.id,
-            score_dict['age'],
-            score_dict['family'],
-            score_dict['income'],
-            score_dict['house_ownership'],
-            score_dict['age_of_car'],
-            score_dict['employed_by'],
-            score_dict['education'],
-            score_dict['marital_status'],
-            score_dict['position'],
-            score_dict['income_type'],
-            score_dict['housing'],
-        ]
-        curr_pos = curr_pos + 1
-
-    print(score_table)
-
-    db_connection.execute_sql("DROP TABLE IF EXISTS %s" % settings.CLIENT_SCORES_TABLE)
-    score_table.set_index('id', drop=True).to_sql(settings.CLIENT_SCORES_TABLE, db_connection.connection)
-
-    export_data("scores table", "clients_scores.csv", score_table.to_csv)
+def main():
+    db_connection = get_connection()
+    # Оцениваются только новые и изменённые анкеты (и те, у кого сменился возраст),
+    # полный пересчёт идёт частями, старые баллы доступны до его конца
+    mode, rows = rescore_profiles(db_connection)
+    print("Scored %d profiles (%s)" % (rows, mode))
+    # Все баллы не читаются в память: печатается начало таблицы, файл пишется частями
+    print(pd.read_sql_query("SELECT * FROM %s ORDER BY id LIMIT 10" % settings.CLIENT_SCORES_TABLE,
+                            db_connection.connection))
+
+    export_data("scores table", "clients_scores.csv", lambda path: export_scores(db_connection, path))
     print("Task 3 done!")
 
 
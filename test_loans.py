@@ -0,0 +1,112 @@
+"""
+The vectorized overdue days against the original per-contract loop of task2 on a few hundred payments.
+
+Usage: python -m unittest test_loans
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from loans import overdue_days
+
+
+def original_overdue_days(payments_df):
+    # The loop of task2 before loans.overdue_days, verbatim apart from the function around it
+    payments_df = payments_df.copy()
+    payments_df['overdue_days'] = -1  # Ставим -1, там, где не было просрочки (потом уберем), а 0 будем ставить там, где должен был быть платеж, но не произошёл
+
+    for contract in payments_df.contract_id.unique():
+        temp_df = payments_df[payments_df.contract_id == contract].sort_values(['payment_date'])
+        # Получаем массив индексов, т.к. индексация в "частях" pandas.DataFrame остаётся как и в исходном
+        index_arr = temp_df.index.tolist()
+        for i in range(1, len(index_arr)):  # Берем индексы с 1, т.к. в 0 всегда просрочка 0 (первый платеж)
+            prev_ind = index_arr[i - 1]
+            ind = index_arr[i]
+            if payments_df.loc[ind, 'amount_paid'] < payments_df.loc[ind, 'amount_due']:  # Платеж не поступил или был меньше
+                if payments_df.loc[prev_ind, 'overdue_days'] == -1:  # Не было просрочки
+                    payments_df.loc[ind, 'overdue_days'] = 0  # С текущей даты пошла просрочка, но пока что 0
+                else:
+                    #  Для простоты будем просто добавлять 30, т.к. платежи ровно через 1 мес.
+                    new_ov_days = 30
+                    payments_df.loc[ind, 'overdue_days'] = payments_df.loc[prev_ind, 'overdue_days'] + new_ov_days  # Складываем прошлую просрочку с текущей
+            elif payments_df.loc[ind, 'amount_paid'] > payments_df.loc[ind, 'amount_due']:
+                months_covered = int(round(payments_df.loc[ind, 'amount_paid'] / payments_df.loc[ind, 'amount_due'], 0))  # Считаем, за сколько месяцев оплатил
+                months_covered = months_covered - 1  # Вычитаем 1 месяца из погашения, т.к. мы не прибавили 30 дней за текущий месяц
+                # Вычитаем из просрочки количество "погашенных" просроченных платежей
+                # В случае более сложного начисления (с процентами, неравномерные платежи) надо использовать логику сложнее
+                payments_df.loc[ind, 'overdue_days'] = payments_df.loc[prev_ind, 'overdue_days'] - months_covered * 30
+                if payments_df.loc[ind, 'overdue_days'] < 0:
+                    payments_df.loc[ind, 'overdue_days'] = -1  # Если погасил весь долг - нет просрочки
+    return payments_df.overdue_days
+
+
+def payments(contract_id, rows):
+    # rows: [(payment_date, amount_due, amount_paid)]
+    dates, due, paid = zip(*rows)
+    return pd.DataFrame({"contract_id": contract_id, "payment_date": pd.to_datetime(list(dates)),
+                         "amount_due": list(due), "amount_paid": list(paid)})
+
+
+def generated_payments(contracts, months, seed):
+    # Monthly payments (no two on one date) in shuffled order; partial, exact, missing and
+    # multi-month ones, x.5 ratios included; every fifth contract misses half of its payments
+    rng = np.random.RandomState(seed)
+    contract_ids = np.repeat(np.arange(200000, 200000 + contracts), months)
+    dates = np.datetime64("2015-01-01") + np.tile(np.arange(months) * 30, contracts) - rng.randint(0, 15, len(contract_ids))
+    due = rng.choice([500.0, 1000.0], len(contract_ids))
+    ratios = rng.choice([0.0, 0.0, 0.5, 1.0, 1.0, 1.0, 1.2, 1.5, 2.0, 2.5, 3.0, 6.0, np.nan], len(contract_ids))
+    ratios[(contract_ids % 5 == 0) & (rng.random_sample(len(contract_ids)) < 0.5)] = 0.0
+    frame = pd.DataFrame({"contract_id": contract_ids, "payment_date": dates.astype("datetime64[ns]"),
+                          "amount_due": due, "amount_paid": due * ratios})
+    return frame.sample(frac=1, random_state=rng).reset_index(drop=True)
+
+
+class OverdueDaysTest(unittest.TestCase):
+
+    def assert_same_as_original(self, payments_df):
+        expected = original_overdue_days(payments_df).rename("overdue_days")
+        result = overdue_days(payments_df)
+        mismatches = payments_df[result != expected]
+        self.assertTrue(result.equals(expected), "disagree on %d rows:\n%s" % (len(mismatches), mismatches))
+
+    def test_cases(self):
+        payments_df = pd.concat([
+            # Unpaid up to 90 days, then paid off by more than the overdue
+            payments(1, [("2016-01-01", 500, 500), ("2016-02-01", 500, 0), ("2016-03-01", 500, 0),
+                         ("2016-04-01", 500, 0), ("2016-05-01", 500, 0), ("2016-06-01", 500, 3000),
+                         ("2016-07-01", 500, 0)]),
+            # Overpaid by x.5 months, rounded half to even
+            payments(2, [("2016-01-01", 1000, 0), ("2016-02-01", 1000, 0), ("2016-03-01", 1000, 0),
+                         ("2016-04-01", 1000, 2500), ("2016-05-01", 1000, 1500), ("2016-06-01", 1000, 1000)]),
+            # An underpaid first payment is never overdue, overpaying ahead stays current,
+            # a missing payment clears the overdue like an exact one
+            payments(4, [("2016-01-01", 500, 100), ("2016-02-01", 500, 2000), ("2016-03-01", 500, 0),
+                         ("2016-04-01", 500, 0), ("2016-05-01", 500, np.nan), ("2016-06-01", 500, 0)]),
+        ], ignore_index=True)
+        self.assert_same_as_original(payments_df.sample(frac=1, random_state=0))
+        self.assert_same_as_original(payments_df)
+        self.assertEqual(overdue_days(payments_df)[payments_df.contract_id == 1].tolist(),
+                         [-1, 0, 30, 60, 90, -1, 0])
+        self.assertEqual(overdue_days(payments_df)[payments_df.contract_id == 2].tolist(),
+                         [-1, 0, 30, 0, -1, -1])
+
+    def test_ties(self):
+        # The original loop left payments on one date in the order of its unstable sort;
+        # overdue_days takes them in the order of the frame
+        payments_df = payments(3, [("2016-01-01", 500, 500), ("2016-02-01", 500, 0), ("2016-02-01", 500, 0),
+                                   ("2016-02-01", 500, 1000), ("2016-03-01", 500, 0), ("2016-03-01", 500, 500)])
+        self.assertEqual(overdue_days(payments_df).tolist(), [-1, 0, 30, 0, 30, -1])
+        reordered = payments_df.iloc[[5, 3, 0, 4, 2, 1]]
+        self.assertEqual(overdue_days(reordered).tolist(), [-1, -1, -1, 0, 0, 30])
+
+    def test_generated(self):
+        for seed in range(3):
+            self.assert_same_as_original(generated_payments(25, 12, seed))
+
+    def test_empty(self):
+        self.assertTrue(overdue_days(generated_payments(0, 12, 0)).empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
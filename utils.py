@@ -1,17 +1,62 @@
 import os
 import settings
-from general import DBhandler
-import datetime
+from connections import get_connection
+import numpy as np
+import pandas as pd
 
-db_connection = DBhandler(db_path=settings.DATABASE_PATH)
+# db_path -> (signature of values_map, {column_name: (codes index, labels)})
+_values_map_cache = dict()
 
 
-def convert_data_from_categorical(values, column_name):
-    new_values = []
-    for value in values:
-        db_connection.cursor.execute("SELECT key FROM %s WHERE column_name = '%s' AND value = %d" % (settings.VALUES_MAP_TABLE, column_name, int(value)))
-        new_values.append(db_connection.cursor.fetchone()[0])
-    return new_values
+def load_values_map(connection):
+    """
+    Return the whole values_map as {column_name: (pd.Index of codes, list of labels)}.
+    The map is read once and cached until its row count or last rowid changes.
+    """
+    connection.cursor.execute("SELECT COUNT(*), MAX(rowid) FROM %s" % settings.VALUES_MAP_TABLE)
+    signature = connection.cursor.fetchone()
+    cached = _values_map_cache.get(connection.db_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    connection.cursor.execute("SELECT column_name, value, key FROM %s ORDER BY column_name, value"
+                              % settings.VALUES_MAP_TABLE)
+    pairs = dict()
+    for column_name, value, key in connection.cursor.fetchall():
+        pairs.setdefault(column_name, ([], []))
+        pairs[column_name][0].append(value)
+        pairs[column_name][1].append(key)
+    values_map = {column_name: (pd.Index(codes), labels) for column_name, (codes, labels) in pairs.items()}
+    _values_map_cache[connection.db_path] = (signature, values_map)
+    return values_map
+
+
+def convert_data_from_categorical(values, column_name, connection=None):
+    """
+    Decode an array of codes into a pandas Categorical of their labels; unknown codes become NaN.
+    The values_map is read from connection, get_connection() by default.
+    """
+    if connection is None:
+        connection = get_connection()
+    codes, labels = load_values_map(connection)[column_name]
+    # Codes repeat a lot, so only the distinct ones are converted and looked up
+    inverse, uniques = pd.Series(values).factorize()
+    positions = codes.get_indexer(pd.to_numeric(pd.Series(uniques), errors='coerce'))
+    positions = np.append(positions, -1)[inverse]  # factorize marks missing values with -1
+    return pd.Categorical.from_codes(positions, labels)
+
+
+def compact_frame(df, categorical=(), integers=()):
+    """
+    Keep the categorical columns as pandas Categorical and the integer columns in the smallest
+    integer dtype that fits their values (columns with missing values are float and stay as they are)
+    """
+    for column in categorical:
+        df[column] = df[column].astype("category")
+    for column in integers:
+        if df[column].dtype.kind in "iu":
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
 
 
 def export_data(export_name, file_name, function_to_call, **params):
@@ -37,7 +82,3 @@ def export_data(export_name, file_name, function_to_call, **params):
 
         function_to_call(os.path.join(output_path, file_name), **params)
         print("File was saved to %s !" % os.path.join(output_path, file_name))
-
-
-def parse_date(str_date):
-    return datetime.datetime.strptime(str_date, "%m.%d.%Y").date()
@@ -0,0 +1,162 @@
+"""
+Weight of evidence and information value of the applicant features.
+
+Usage: python woe.py --horizon 12 [--output woe] [--workers 4]
+computes the tables of every feature at once, ranks the features by IV and
+saves everything to the output folder and to SQLite.
+"""
+import argparse
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import settings
+from connections import get_connection
+from loans import client_defaults, default_matrix, horizon_defaults, horizon_payments, load_default_dates, refresh_performance
+from utils import compact_frame
+
+QUANTILIZED_COLUMNS = ['income', 'age', 'age_of_car']
+
+CATEGORICAL_COLUMNS = ['gender',
+                       'employed_by',
+                       'education',
+                       'marital_status',
+                       'position',
+                       'income_type',
+                       'housing',
+                       'house_ownership',
+                       'children',
+                       'family',
+                       ]
+
+FEATURES = sorted(CATEGORICAL_COLUMNS + QUANTILIZED_COLUMNS)
+
+
+def load_applications(connection, defaulted_ids):
+    """
+    Profiles indexed by id with the default flag, the binned income, age and age_of_car
+    and the other features as pandas Categorical
+    """
+    applications_df = pd.read_sql_query("SELECT * FROM %s" % settings.PROFILE_TABLE, connection.connection,
+                                        index_col='id', parse_dates=['birth'])
+
+    applications_df.drop(["issue_date"], axis=1, inplace=True)
+
+    # Клиент, по которому мало данных
+    if 100076 in applications_df.index:
+        applications_df.drop([100076], inplace=True)
+
+    applications_df.fillna(0.0, inplace=True)
+
+    applications_df['default'] = 0
+    applications_df.loc[applications_df.index.isin(defaulted_ids), "default"] = 1
+
+    applications_df['age'] = (pd.Timestamp(datetime.date.today()) - applications_df.birth).dt.days // 365
+    applications_df.drop(['birth'], axis=1, inplace=True)
+
+    applications_df.income = pd.qcut(applications_df.income, 5)
+    age_of_car = applications_df.age_of_car.values
+    applications_df.age_of_car = pd.Categorical(np.select([age_of_car == 0, age_of_car <= 3], ['0', '<=3'], '>3'))
+    applications_df.age = pd.qcut(applications_df.age, 5)
+    return compact_frame(applications_df, categorical=CATEGORICAL_COLUMNS)
+
+
+def woe_table(applications_df, column):
+    """
+    WOE and IV of every value of the column, without the SUM row
+    """
+    groups = applications_df.groupby([column], observed=False)['default'].agg(['sum', 'count'])
+    events = groups['sum'].sum()
+    non_events = groups['count'].sum() - events
+
+    df_gb = pd.DataFrame({"default": groups['sum'],
+                          "event": groups['sum'] / events,
+                          "non_event": (groups['count'] - groups['sum']) / non_events})
+    df_gb['woe'] = np.log(np.clip(df_gb.event / df_gb.non_event, 0.001, np.inf))
+    df_gb['IV'] = (df_gb.event - df_gb.non_event) * df_gb.woe
+    df_gb.index = df_gb.index.astype(str)
+    return df_gb
+
+
+def _column_table(args):
+    return woe_table(*args)
+
+
+def woe_tables(applications_df, columns=FEATURES, workers=1):
+    """
+    {column: woe_table} for all the columns. With workers > 1 and at least
+    settings.WOE_PARALLEL_ROWS rows the columns are spread over processes.
+    """
+    jobs = [(applications_df[[column, 'default']], column) for column in columns]
+    if workers > 1 and len(applications_df) >= settings.WOE_PARALLEL_ROWS:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(_column_table, jobs))
+    else:
+        tables = [_column_table(job) for job in jobs]
+    return dict(zip(columns, tables))
+
+
+def iv_summary(tables):
+    """
+    Features ranked by their total IV
+    """
+    summary = pd.DataFrame({"feature": list(tables.keys()),
+                            "iv": [table.IV.sum() for table in tables.values()],
+                            "bins": [len(table) for table in tables.values()]})
+    summary = summary.sort_values(["iv"], ascending=False, kind="mergesort").reset_index(drop=True)
+    summary['rank'] = summary.index + 1
+    return summary
+
+
+def save_tables(connection, tables, summary, output_path=None):
+    """
+    Store the summary and the per-feature tables in SQLite and, with output_path, as CSV files
+    """
+    with connection.transaction():
+        connection.create_table(type_=settings.WOE_SUMMARY_TABLE)
+        connection.create_table(type_=settings.WOE_TABLE)
+        connection.execute_sql("DELETE FROM %s" % settings.WOE_SUMMARY_TABLE)
+        connection.execute_sql("DELETE FROM %s" % settings.WOE_TABLE)
+        connection.cursor.executemany("INSERT INTO %s VALUES (?, ?, ?, ?)" % settings.WOE_SUMMARY_TABLE, zip(
+            summary.feature.tolist(), summary.iv.tolist(), summary.bins.tolist(), summary['rank'].tolist()))
+        for feature, table in tables.items():
+            connection.cursor.executemany("INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?, ?)" % settings.WOE_TABLE, zip(
+                [feature] * len(table), table.index.tolist(), table['default'].tolist(), table.event.tolist(),
+                table.non_event.tolist(), table.woe.tolist(), table.IV.tolist()))
+
+    if output_path:
+        os.makedirs(output_path, exist_ok=True)
+        summary.to_csv(os.path.join(output_path, "iv_summary.csv"), index=False)
+        for feature, table in tables.items():
+            table = table.copy()
+            table.loc['SUM'] = table.sum()
+            table.to_csv(os.path.join(output_path, "woe_%s.csv" % feature))
+
+
+def defaulted_clients(connection, horizon):
+    refresh_performance(connection)
+    matrix = default_matrix(horizon_payments(connection, [horizon]), load_default_dates(connection), [horizon])
+    out_df_gb = horizon_defaults(client_defaults(matrix), horizon)
+    return out_df_gb[out_df_gb['Default?']].id_number.unique()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--horizon", type=int, default=12, help="risk horizon in months")
+    parser.add_argument("--output", default="woe", help="folder for the CSV files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    connection = get_connection()
+    applications_df = load_applications(connection, defaulted_clients(connection, args.horizon))
+    tables = woe_tables(applications_df, workers=args.workers)
+    summary = iv_summary(tables)
+    save_tables(connection, tables, summary, args.output)
+    print(summary.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()